@@ -0,0 +1,89 @@
+"""Response encoding for the serverless API: compact JSON, pre-encoded fragments and compression"""
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this go out uncompressed; headers and CPU would cost more than they save
+MIN_COMPRESS_SIZE = int(os.environ.get('STREAM_MIN_COMPRESS_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('STREAM_GZIP_LEVEL', '5'))
+BROTLI_QUALITY = int(os.environ.get('STREAM_BROTLI_QUALITY', '4'))
+
+# Content codings we can produce, best first
+ENCODINGS = (('br',) if brotli else ()) + ('gzip',)
+
+
+class Encoded(bytes):
+    """A value that is already JSON; dumps() writes it into a response as it is"""
+
+
+def encode(value):
+    """Compact UTF-8 JSON, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def encode_list(fragments):
+    return Encoded(b'[' + b','.join(fragments) + b']')
+
+
+def dumps(response):
+    """Encode a response dict whose top-level values may be Encoded, splicing those in unchanged"""
+    if not any(isinstance(value, Encoded) for value in response.values()):
+        return encode(response)
+    parts = [
+        encode(key) + b':' + (value if isinstance(value, Encoded) else encode(value))
+        for key, value in response.items()
+    ]
+    return b'{' + b','.join(parts) + b'}'
+
+
+def negotiate(accept_encoding):
+    """The best coding in ENCODINGS that Accept-Encoding allows, or None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    best = None
+    for coding in ENCODINGS:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > 0 and (best is None or weight > weights.get(best, weights.get('*', 0.0))):
+            best = coding
+    return best
+
+
+def content_coding(body, coding):
+    """The coding compress(body, coding) will actually use, None for identity"""
+    if coding is None or len(body) < MIN_COMPRESS_SIZE:
+        return None
+    return coding
+
+
+def compress(body, coding):
+    """The body in the given coding, and the coding actually used (None when left as is)"""
+    coding = content_coding(body, coding)
+    if coding is None:
+        return body, None
+    if coding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY), coding
+    # mtime=0 keeps the output a function of the body alone, as strong ETags need
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), coding
@@ -0,0 +1,259 @@
+"""In-memory stream store for the serverless API, indexed so lookups do not scan every stream"""
+import re
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from _rtsp_probe import normalize_codec
+
+# Words of names, locations and search queries
+TOKEN = re.compile(r'[a-z0-9]+')
+
+EMPTY = frozenset()
+
+
+def tokenize(text):
+    return TOKEN.findall(str(text).lower()) if text else []
+
+
+def index_key(field, value):
+    """The form a value is indexed and looked up by; codecs go through normalize_codec(), so hevc finds H.265"""
+    if value is None:
+        return None
+    if field == 'codec':
+        return normalize_codec(value)
+    if field == 'resolution':
+        return str(value).lower()
+    return value
+
+
+class StreamStore:
+    """Streams by id, with secondary indexes on is_active, is_favorite, category, codec and resolution
+
+    Ids come from a counter and are never reused, so iterating the primary dict
+    yields streams in id order. Every insert, update and delete keeps the indexes
+    in step in O(1); a filtered list costs O(k log k) in the size of the match, or
+    one pass over the primary dict when most streams match.
+
+    order keeps every id in ascending order for keyset pages: a page after id n
+    starts with a bisect instead of a walk over the streams before it. Deleted ids
+    stay in order until they outnumber the live ones and it is compacted.
+
+    Search goes through an inverted index from each word of a stream's name,
+    location and category to the ids containing it. Every word of a query must
+    start some word of the stream; the words it starts are a bisected range of
+    the sorted vocabulary.
+
+    version goes up by one with every add, update and delete, and versions holds
+    the version at which each stream last changed, so "has anything changed since
+    version n" is one comparison. instance tells apart stores that count the same
+    versions independently, such as two warm serverless instances.
+
+    fragments caches each stream's encoded form for list responses; a stream's
+    entry is dropped whenever it changes.
+    """
+
+    INDEXED_FIELDS = ('is_active', 'is_favorite', 'category', 'codec', 'resolution')
+    # Fields kept in stream['metadata'] rather than on the stream itself
+    METADATA_FIELDS = ('codec', 'resolution', 'location')
+    SEARCH_FIELDS = ('name', 'location', 'category')
+
+    def __init__(self, streams=()):
+        self.streams = {}
+        self.indexes = {field: {} for field in self.INDEXED_FIELDS}
+        self.next_id = 1
+        self.order = []
+        self.dead = 0
+        self.tokens = {}
+        self.vocabulary = []
+        self.terms = {}
+        self.instance = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.versions = {}
+        self.modified_at = None
+        self.fragments = {}
+        for stream in streams:
+            self.add(stream)
+
+    def __len__(self):
+        return len(self.streams)
+
+    def _changed(self, stream_id, deleted=False):
+        self.version += 1
+        self.modified_at = datetime.utcnow().isoformat() + 'Z'
+        self.fragments.pop(stream_id, None)
+        if deleted:
+            del self.versions[stream_id]
+        else:
+            self.versions[stream_id] = self.version
+
+    def _value(self, stream, field):
+        if field in self.METADATA_FIELDS:
+            return (stream.get('metadata') or {}).get(field)
+        return stream.get(field)
+
+    def _index(self, stream):
+        stream_id = stream['id']
+        for field in self.INDEXED_FIELDS:
+            self.indexes[field].setdefault(index_key(field, self._value(stream, field)), set()).add(stream_id)
+        terms = frozenset(word for field in self.SEARCH_FIELDS for word in tokenize(self._value(stream, field)))
+        self.terms[stream_id] = terms
+        for term in terms:
+            ids = self.tokens.get(term)
+            if ids is None:
+                ids = self.tokens[term] = set()
+                insort(self.vocabulary, term)
+            ids.add(stream_id)
+
+    def _unindex(self, stream):
+        stream_id = stream['id']
+        for field in self.INDEXED_FIELDS:
+            key = index_key(field, self._value(stream, field))
+            ids = self.indexes[field].get(key)
+            if ids is not None:
+                ids.discard(stream_id)
+                if not ids:
+                    del self.indexes[field][key]
+        for term in self.terms.pop(stream_id, ()):
+            ids = self.tokens[term]
+            ids.discard(stream_id)
+            if not ids:
+                del self.tokens[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def add(self, stream):
+        """Store a stream, giving it the next id unless it already has one"""
+        if stream.get('id') is None:
+            stream['id'] = self.next_id
+        self.next_id = max(self.next_id, stream['id'] + 1)
+        if stream['id'] in self.streams:
+            self._unindex(self.streams[stream['id']])
+        elif not self.order or stream['id'] > self.order[-1]:
+            self.order.append(stream['id'])
+        else:
+            insort(self.order, stream['id'])
+        self.streams[stream['id']] = stream
+        self._index(stream)
+        self._changed(stream['id'])
+        return stream
+
+    def get(self, stream_id):
+        return self.streams.get(stream_id)
+
+    def fragment(self, stream, encode):
+        """encode(stream), kept until the stream next changes"""
+        fragment = self.fragments.get(stream['id'])
+        if fragment is None:
+            fragment = self.fragments[stream['id']] = encode(stream)
+        return fragment
+
+    def update(self, stream_id, **fields):
+        """Change fields of a stream and reindex it; returns the stream or None"""
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            return None
+        reindex = any(field in fields for field in ('metadata',) + self.INDEXED_FIELDS + self.SEARCH_FIELDS)
+        if reindex:
+            self._unindex(stream)
+        stream.update(fields)
+        if reindex:
+            self._index(stream)
+        self._changed(stream_id)
+        return stream
+
+    def delete(self, stream_id):
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            self._unindex(stream)
+            self._changed(stream_id, deleted=True)
+            self.dead += 1
+            if self.dead > len(self.streams):
+                self.order = [stream_id for stream_id in self.order if stream_id in self.streams]
+                self.dead = 0
+        return stream
+
+    def all(self):
+        return list(self.streams.values())
+
+    def candidates(self, criteria, q=None):
+        """Sets of ids, smallest first, whose intersection is every stream matching the criteria and q
+
+        An empty list matches every stream. Callers intersect only as far as they need:
+        count() takes all of it, page() may instead test each id against the sets.
+        """
+        sets = [self.indexes[field].get(index_key(field, value), EMPTY) for field, value in criteria.items()]
+        prefixes = []
+        for prefix in set(tokenize(q)):
+            start = bisect_left(self.vocabulary, prefix)
+            # Words are [a-z0-9] only, so every word starting with prefix sorts before prefix + '~'
+            terms = self.vocabulary[start:bisect_left(self.vocabulary, prefix + '~', start)]
+            if len(terms) == 1:
+                sets.append(self.tokens[terms[0]])
+            else:
+                matches = [self.tokens[term] for term in terms]
+                prefixes.append((sum(len(match) for match in matches), prefix, matches))
+        sets.sort(key=len)
+        # Narrowest prefixes first, so the wide ones can be checked against few candidates
+        prefixes.sort(key=lambda prefix: prefix[0])
+        for size, prefix, matches in prefixes:
+            if sets and len(sets[0]) * 16 < size:
+                # Far fewer candidates than prefix matches: check the candidates' own words instead
+                sets[0] = {stream_id for stream_id in sets[0] if any(term.startswith(prefix) for term in self.terms[stream_id])}
+            else:
+                sets.append(set().union(*matches))
+            sets.sort(key=len)
+        return sets
+
+    def matching(self, criteria, q=None):
+        """Ids matching every criterion and every word of q, or None when nothing narrows the streams"""
+        sets = self.candidates(criteria, q)
+        if not sets:
+            return None
+        return sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+
+    def filter(self, q=None, **criteria):
+        """Streams whose indexed fields equal every criterion and that match the search q, in id order"""
+        ids = self.matching(criteria, q)
+        if ids is None:
+            return self.all()
+        if len(ids) * 8 > len(self.streams):
+            # Most streams match: walking the id-ordered primary dict beats sorting the ids
+            return [stream for stream_id, stream in self.streams.items() if stream_id in ids]
+        return [self.streams[stream_id] for stream_id in sorted(ids)]
+
+    def count(self, q=None, **criteria):
+        ids = self.matching(criteria, q)
+        return len(self.streams) if ids is None else len(ids)
+
+    def page(self, after=None, limit=100, q=None, **criteria):
+        """Up to limit matching streams with ids above after, in id order, and whether more follow
+
+        Keyset paging: a stream created while a client pages through can only land
+        after the last page, so pages never shift or repeat. The match is never
+        counted; when it is large the page comes from walking the id order and
+        testing each id, which stops as soon as the page is full.
+        """
+        sets = self.candidates(criteria, q)
+        ordered = self.order
+        if sets:
+            # Expected matches if the sets are independent, and what each way would cost
+            total = len(self.streams) or 1
+            expected = total
+            for ids in sets:
+                expected *= len(ids) / total
+            # Each step of the walk is interpreted, so it counts for several lookups inside set.intersection
+            walk = limit * total / max(expected, 1) * len(sets) * 8
+            if len(sets[0]) * len(sets) + expected < walk:
+                ordered = sorted(sets[0].intersection(*sets[1:]))
+                sets = []
+        first, rest = (sets[0], sets[1:]) if sets else (None, ())
+        results = []
+        for index in range(bisect_right(ordered, after) if after is not None else 0, len(ordered)):
+            stream_id = ordered[index]
+            if stream_id not in self.streams or (first is not None and stream_id not in first):
+                continue
+            if rest and not all(stream_id in ids for ids in rest):
+                continue
+            if len(results) == limit:
+                return results, True
+            results.append(self.streams[stream_id])
+        return results, False
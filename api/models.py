@@ -1,6 +1,27 @@
 from django.db import models
+from django.db.models.fields.json import KeyTextTransform, compile_json_path
+from django.db.models.functions import Lower
 import json
 
+
+class MetadataText(KeyTextTransform):
+    """One key of Stream.metadata as text, usable in expression indexes
+
+    Django's SQLite SQL for a key transform lists JSON types in set order, which
+    differs between processes, and binds the JSON path as a parameter; SQLite only
+    uses an expression index for the identical expression, constants included.
+    Plain JSON_EXTRACT with the path inlined is stable and gives strings as text.
+    """
+
+    def __init__(self, key_name):
+        super().__init__(key_name, 'metadata')
+
+    def as_sqlite(self, compiler, connection):
+        lhs, params, key_transforms = self.preprocess_lhs(compiler, connection)
+        json_path = compile_json_path(key_transforms).replace("'", "''")
+        return f"JSON_EXTRACT({lhs}, '{json_path}')", params
+
+
 class Stream(models.Model):
     url = models.URLField(max_length=500)
     name = models.CharField(max_length=200, blank=True)
@@ -19,6 +40,14 @@ class Stream(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # What the list filters and keyset pages look up by; see StreamFilterBackend
+        indexes = [
+            models.Index(fields=['is_active', '-id'], name='stream_active_idx'),
+            models.Index(fields=['is_favorite', '-id'], name='stream_favorite_idx'),
+            models.Index(fields=['category', '-id'], name='stream_category_idx'),
+            models.Index(Lower(MetadataText('codec')), name='stream_codec_idx'),
+            models.Index(Lower(MetadataText('resolution')), name='stream_resolution_idx'),
+        ]
 
     def get_metadata(self):
         return self.metadata or {}
@@ -27,4 +56,6 @@ class Stream(models.Model):
         if not self.metadata:
             self.metadata = {}
         self.metadata[key] = value
-        self.save()
+        # Only these columns: the instance may be stale, and a full save would undo
+        # is_active or is_favorite changes made since it was loaded
+        self.save(update_fields=['metadata', 'updated_at'])
@@ -1,7 +1,28 @@
 from rest_framework import serializers
 from .models import Stream
 
+
+def requested_fields(request):
+    """The ?fields=id,name,... projection of a GET request, or None for whole streams"""
+    value = request.query_params.get('fields') if request.method == 'GET' else None
+    if not value:
+        return None
+    fields = list(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in StreamSerializer.Meta.fields]
+    if unknown:
+        raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+    return fields
+
+
 class StreamSerializer(serializers.ModelSerializer):
+    def __init__(self, *args, **kwargs):
+        # Only these fields are rendered when given, see requested_fields()
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     class Meta:
         model = Stream
         fields = [
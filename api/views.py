@@ -4,10 +4,21 @@ from rest_framework.response import Response
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+import asyncio
 import json
+import os
 import time
 from .models import Stream
-from .serializers import StreamSerializer
+from .serializers import StreamSerializer, requested_fields
+from ._listing import StreamCursorPagination, StreamFilterBackend
+from ._rtsp_probe import ProbeCache, cached_probe, is_rtsp_url
+
+PROBE_TIMEOUT = float(os.environ.get('STREAM_PROBE_TIMEOUT', '5'))
+# Kept per warm serverless instance, so repeated validations from the UI skip the camera
+probe_cache = ProbeCache(
+    ttl=float(os.environ.get('STREAM_PROBE_CACHE_TTL', '300')),
+    negative_ttl=float(os.environ.get('STREAM_PROBE_NEGATIVE_TTL', '15')),
+)
 
 # Initialize database on first import
 def init_db():
@@ -22,21 +33,39 @@ init_db()
 @method_decorator(csrf_exempt, name='dispatch')
 class StreamViewSet(viewsets.ModelViewSet):
     serializer_class = StreamSerializer
+    pagination_class = StreamCursorPagination
+    filter_backends = [StreamFilterBackend]
     
     def get_queryset(self):
-        return Stream.objects.all()
+        return self.project(Stream.objects.all())
+
+    def get_serializer(self, *args, **kwargs):
+        fields = requested_fields(self.request)
+        if fields:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def project(self, queryset):
+        """Load only the requested ?fields= columns"""
+        fields = requested_fields(self.request)
+        return queryset.only(*fields) if fields else queryset
+
+    def paginated(self, queryset):
+        queryset = self.filter_queryset(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.get_serializer(queryset, many=True).data)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
     @action(detail=False, methods=['get'])
     def active(self, request):
-        active_streams = Stream.objects.filter(is_active=True)
-        serializer = self.get_serializer(active_streams, many=True)
-        return Response(serializer.data)
+        active_streams = self.get_queryset().filter(is_active=True)
+        return self.paginated(active_streams)
 
     @action(detail=False, methods=['get'])
     def favorites(self, request):
-        favorite_streams = Stream.objects.filter(is_favorite=True)
-        serializer = self.get_serializer(favorite_streams, many=True)
-        return Response(serializer.data)
+        favorite_streams = self.get_queryset().filter(is_favorite=True)
+        return self.paginated(favorite_streams)
 
     @action(detail=True, methods=['post'])
     def toggle_favorite(self, request, pk=None):
@@ -69,18 +98,20 @@ class StreamViewSet(viewsets.ModelViewSet):
         
         try:
             # Simple validation - check if URL format is correct
-            if not rtsp_url.startswith('rtsp://'):
+            if not is_rtsp_url(rtsp_url):
                 return Response({'valid': False, 'error': 'Invalid RTSP URL format'})
-            
-            # For Vercel deployment, we'll simulate stream validation
-            # In production, you'd use FFmpeg to probe the stream
+
+            # OPTIONS/DESCRIBE against the camera; the SDP tells codec, resolution and fps
+            result = asyncio.run(cached_probe(rtsp_url, probe_cache, PROBE_TIMEOUT))
             return Response({
-                'valid': True,
+                'valid': result['valid'],
+                'reachable': result['reachable'],
+                'error': result['error'],
+                'cached': result['cached'],
                 'metadata': {
-                    'resolution': '1920x1080',
-                    'fps': 30,
-                    'codec': 'H.264'
-                }
+                    key: result.get(key)
+                    for key in ('codec', 'profile', 'level', 'resolution', 'fps', 'audio_codec', 'server', 'methods')
+                },
             })
         except Exception as e:
             return Response({'valid': False, 'error': str(e)}, 
@@ -88,21 +119,26 @@ class StreamViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def stream_data(self, request):
-        """Simulate stream data for demo purposes"""
+        """What the last RTSP probe of the stream measured; there is no ingest to report on here"""
         stream_id = request.GET.get('stream_id')
         if not stream_id:
             return Response({'error': 'Stream ID required'}, 
                           status=status.HTTP_400_BAD_REQUEST)
-        
-        # Simulate stream data
-        mock_data = {
+
+        stream = Stream.objects.filter(pk=stream_id).first() if stream_id.isdigit() else None
+        if stream is None:
+            return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        probe = probe_cache.get(stream.url) or {}
+        metadata = stream.metadata or {}
+        return Response({
             'stream_id': stream_id,
-            'status': 'connected',
-            'bandwidth': 2048,  # KB/s
-            'fps': 30,
-            'resolution': '1920x1080',
-            'uptime': 3600,  # seconds
+            'status': 'connected' if stream.is_active else 'paused',
+            'bandwidth': None,
+            'fps': probe.get('fps') or metadata.get('fps'),
+            'resolution': probe.get('resolution') or metadata.get('resolution'),
+            'uptime': None,
+            'latency': probe.get('connect_ms'),
+            'reachable': probe.get('reachable'),
             'timestamp': time.time()
-        }
-        
-        return Response(mock_data)
+        })
@@ -1,13 +1,18 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import streams.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtsp_viewer.settings')
+# Sets Django up, so it must run before anything below imports models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import streams.routing  # noqa: E402
+from streams.prewarm import lifespan  # noqa: E402
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
+    "lifespan": lifespan,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             streams.routing.websocket_urlpatterns
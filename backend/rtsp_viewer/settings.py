@@ -118,3 +118,83 @@ REST_FRAMEWORK = {
 
 # FFmpeg path
 FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+
+# Seconds a shared camera ingest keeps running after its last viewer leaves
+STREAM_HUB_GRACE_PERIOD = float(os.environ.get('STREAM_HUB_GRACE_PERIOD', '10'))
+
+# Late-join buffer kept per shared stream: init segment plus the most recent fragments
+STREAM_BUFFER_MAX_FRAGMENTS = int(os.environ.get('STREAM_BUFFER_MAX_FRAGMENTS', '8'))
+STREAM_BUFFER_MAX_BYTES = int(os.environ.get('STREAM_BUFFER_MAX_BYTES', str(8 * 1024 * 1024)))
+STREAM_BUFFER_MAX_SECONDS = float(os.environ.get('STREAM_BUFFER_MAX_SECONDS', '10'))
+
+# Per-viewer send queue; a viewer that falls further behind skips to the next keyframe
+STREAM_CLIENT_QUEUE_MAX_BYTES = int(os.environ.get('STREAM_CLIENT_QUEUE_MAX_BYTES', str(4 * 1024 * 1024)))
+STREAM_CLIENT_QUEUE_MAX_FRAGMENTS = int(os.environ.get('STREAM_CLIENT_QUEUE_MAX_FRAGMENTS', '16'))
+
+# Source codec probing used to choose between passthrough remux and transcoding
+FFPROBE_PATH = os.environ.get('FFPROBE_PATH', 'ffprobe')
+STREAM_PROBE_TIMEOUT = float(os.environ.get('STREAM_PROBE_TIMEOUT', '5'))
+
+# Server-side mosaic composed for grid views (ws/mosaic/)
+MOSAIC_WIDTH = int(os.environ.get('MOSAIC_WIDTH', '1920'))
+MOSAIC_HEIGHT = int(os.environ.get('MOSAIC_HEIGHT', '1080'))
+MOSAIC_FPS = int(os.environ.get('MOSAIC_FPS', '15'))
+MOSAIC_MAX_TILES = int(os.environ.get('MOSAIC_MAX_TILES', '25'))
+
+# Bytes each stream may send per round on a multiplexed socket (ws/streams/)
+STREAM_MUX_QUANTUM = int(os.environ.get('STREAM_MUX_QUANTUM', str(64 * 1024)))
+
+# Ingest supervision: restart FFmpeg on exit or after this many seconds without output
+STREAM_STALL_TIMEOUT = float(os.environ.get('STREAM_STALL_TIMEOUT', '10'))
+STREAM_RESTART_BACKOFF_BASE = float(os.environ.get('STREAM_RESTART_BACKOFF_BASE', '0.25'))
+STREAM_RESTART_BACKOFF_MAX = float(os.environ.get('STREAM_RESTART_BACKOFF_MAX', '30'))
+STREAM_RESTART_MAX_ATTEMPTS = int(os.environ.get('STREAM_RESTART_MAX_ATTEMPTS', '0'))
+
+# Admission control: estimated cores FFmpeg may use, and the share only favorite/priority streams may take
+STREAM_CPU_BUDGET = float(os.environ.get('STREAM_CPU_BUDGET', os.cpu_count() or 1))
+STREAM_PRIORITY_RESERVE = float(os.environ.get('STREAM_PRIORITY_RESERVE', '0.25'))
+STREAM_PRIORITY_CATEGORIES = os.environ.get('STREAM_PRIORITY_CATEGORIES', 'security').split(',')
+
+# Paused viewers release their ingest after this many seconds if nobody else is watching
+STREAM_PAUSE_GRACE_PERIOD = float(os.environ.get('STREAM_PAUSE_GRACE_PERIOD', '30'))
+
+# Prewarming: favorites and streams with metadata prewarm_hours are kept running without viewers
+STREAM_PREWARM_FAVORITES = os.environ.get('STREAM_PREWARM_FAVORITES', 'True').lower() == 'true'
+STREAM_PREWARM_INTERVAL = float(os.environ.get('STREAM_PREWARM_INTERVAL', '60'))
+STREAM_PREWARM_MAX = int(os.environ.get('STREAM_PREWARM_MAX', '8'))
+
+# Ingest profile for streams without metadata ingest_profile: default, low-latency, robust-tcp or lossy-udp
+STREAM_DEFAULT_INGEST_PROFILE = os.environ.get('STREAM_DEFAULT_INGEST_PROFILE', 'default')
+
+# Keyframe on demand: a viewer joining a running transcode gets a fresh IDR, at most once per interval.
+# Off by default: each request runs a second encoder and camera session until it takes over
+STREAM_KEYFRAME_ON_JOIN = os.environ.get('STREAM_KEYFRAME_ON_JOIN', 'False').lower() == 'true'
+STREAM_KEYFRAME_MIN_INTERVAL = float(os.environ.get('STREAM_KEYFRAME_MIN_INTERVAL', '10'))
+STREAM_KEYFRAME_REPLACE_TIMEOUT = float(os.environ.get('STREAM_KEYFRAME_REPLACE_TIMEOUT', '10'))
+# Transcoded output is fragmented at keyframes and at least this often (seconds, 0 for keyframes only)
+STREAM_FRAGMENT_DURATION = float(os.environ.get('STREAM_FRAGMENT_DURATION', '0.5'))
+
+# RTSP DESCRIBE probe results are reused for this many seconds, failures for the negative TTL
+STREAM_PROBE_CACHE_TTL = float(os.environ.get('STREAM_PROBE_CACHE_TTL', '300'))
+STREAM_PROBE_NEGATIVE_TTL = float(os.environ.get('STREAM_PROBE_NEGATIVE_TTL', '15'))
+
+# Batch validation: URLs per request, probes in flight overall and per camera host
+STREAM_BATCH_MAX_URLS = int(os.environ.get('STREAM_BATCH_MAX_URLS', '1000'))
+STREAM_BATCH_CONCURRENCY = int(os.environ.get('STREAM_BATCH_CONCURRENCY', '64'))
+STREAM_BATCH_PER_HOST = int(os.environ.get('STREAM_BATCH_PER_HOST', '4'))
+
+# Liveness sweeps: every tick, streams that are due are probed and is_active follows the result.
+# Intervals grow from MIN to MAX while a stream stays stable; a TICK of 0 disables in-process sweeps
+STREAM_LIVENESS_TICK = float(os.environ.get('STREAM_LIVENESS_TICK', '5'))
+STREAM_LIVENESS_MIN_INTERVAL = float(os.environ.get('STREAM_LIVENESS_MIN_INTERVAL', '30'))
+STREAM_LIVENESS_MAX_INTERVAL = float(os.environ.get('STREAM_LIVENESS_MAX_INTERVAL', '600'))
+STREAM_LIVENESS_FAILURES = int(os.environ.get('STREAM_LIVENESS_FAILURES', '2'))
+STREAM_LIVENESS_MAX_PER_SWEEP = int(os.environ.get('STREAM_LIVENESS_MAX_PER_SWEEP', '500'))
+STREAM_LIVENESS_CONCURRENCY = int(os.environ.get('STREAM_LIVENESS_CONCURRENCY', '32'))
+STREAM_LIVENESS_PER_HOST = int(os.environ.get('STREAM_LIVENESS_PER_HOST', '2'))
+
+# FFmpeg reports progress (fps, bitrate, dropped frames) this often, in seconds; 0 turns telemetry off
+STREAM_PROGRESS_PERIOD = float(os.environ.get('STREAM_PROGRESS_PERIOD', '1'))
+
+# Metric history (1s/10s/1m rollups over 24h) is kept for at most this many cameras, about 98 KB each
+STREAM_HISTORY_MAX_STREAMS = int(os.environ.get('STREAM_HISTORY_MAX_STREAMS', '1000'))
@@ -0,0 +1,71 @@
+import time
+from collections import deque
+
+
+class Fragment:
+    """A complete moof+mdat unit as it left the ingest"""
+
+    __slots__ = ('data', 'keyframe', 'frames', 'duration', 'received_at')
+
+    def __init__(self, data, keyframe=True, frames=None, duration=None, received_at=None):
+        self.data = data
+        self.keyframe = keyframe
+        self.frames = frames
+        self.duration = duration
+        self.received_at = time.monotonic() if received_at is None else received_at
+
+
+class FragmentRingBuffer:
+    """Keeps the init segment and the most recent fragments of a stream for late joiners
+
+    The buffer is bounded by fragment count, total bytes and the time spanned by its
+    fragments, but never evicts the newest keyframe fragment or anything after it, so
+    a new viewer can always start decoding straight away.
+    """
+
+    def __init__(self, max_fragments=8, max_bytes=8 * 1024 * 1024, max_duration=10.0):
+        self.max_fragments = max_fragments
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.init_segment = None
+        self.fragments = deque()
+        self.size = 0
+        self.last_keyframe_index = None
+
+    def set_init_segment(self, data):
+        self.init_segment = data
+        # Fragments from a previous encoder session cannot be decoded with the new init
+        self.fragments.clear()
+        self.size = 0
+        self.last_keyframe_index = None
+
+    def append(self, fragment):
+        self.fragments.append(fragment)
+        self.size += len(fragment.data)
+        if fragment.keyframe:
+            self.last_keyframe_index = len(self.fragments) - 1
+        self._evict()
+
+    def _evict(self):
+        while self.fragments and self._over_limit():
+            if self.last_keyframe_index == 0:
+                break
+            oldest = self.fragments.popleft()
+            self.size -= len(oldest.data)
+            if self.last_keyframe_index is not None:
+                self.last_keyframe_index -= 1
+
+    def _over_limit(self):
+        span = self.fragments[-1].received_at - self.fragments[0].received_at
+        return (len(self.fragments) > self.max_fragments
+                or self.size > self.max_bytes
+                or span > self.max_duration)
+
+    def late_join(self):
+        """Return the init segment and fragments a new viewer needs to start decoding"""
+        if self.init_segment is None:
+            return None, []
+        if self.last_keyframe_index is None:
+            return self.init_segment, []
+        fragments = list(self.fragments)[self.last_keyframe_index:]
+        return self.init_segment, fragments
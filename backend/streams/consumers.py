@@ -1,23 +1,72 @@
 import json
 import asyncio
-import subprocess
 import base64
 import logging
+from functools import partial
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.conf import settings
+from .frames import (
+    FLAG_INIT_SEGMENT, TRANSPORTS, TRANSPORT_BINARY, TRANSPORT_JSON, encode_frame, numeric_stream_id,
+)
+from .hub import hub
+from .liveness import STATUS_GROUP, sweeper
+from .models import Stream
+from .prewarm import prewarmer
+from .probe import resolve_profile
+from .profiles import (
+    LADDER_RENDITIONS, PROFILE_LADDER, PROFILES, QUALITY_RENDITIONS, RENDITION_AUTO,
+)
+from .scheduler import PRIORITY_HIGH, AdmissionRefused, stream_priority, stream_size
+from .startup import stream_ingest_profile
+from .subscriber import Subscriber
 
 logger = logging.getLogger(__name__)
 
+
+@database_sync_to_async
+def get_stream(stream_id):
+    if not str(stream_id).isdigit():
+        return None
+    return Stream.objects.filter(pk=stream_id).first()
+
+
+def start_background_tasks():
+    """Start the prewarmer and liveness sweeper, if not yet running, on the server's loop"""
+    prewarmer.ensure_started()
+    sweeper.ensure_started()
+
+
+def starting_rendition(stream, profile, rendition):
+    """The rendition a viewer joins at and whether it adapts from there
+
+    Ladder viewers asking for 'auto' or nothing start at the stream's stored quality,
+    720p when that is 'auto' or unknown; only 'auto' then follows the viewer's bandwidth.
+    """
+    if profile != PROFILE_LADDER or rendition not in (None, RENDITION_AUTO):
+        return rendition, False
+    return QUALITY_RENDITIONS.get(stream.quality if stream else None, '720p'), rendition == RENDITION_AUTO
+
+
 class StreamConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.stream_id = None
-        self.ffmpeg_process = None
+        self.source = None
+        self.subscriber = None
         self.streaming_task = None
         self.is_streaming = False
+        self.transport = TRANSPORT_JSON
+        self.sequence = 0
+        self.announced_rendition = None
+        # How the current stream was started, kept while paused so resume can resubscribe
+        self.request = None
+        self.paused_request = None
 
     async def connect(self):
         self.stream_id = self.scope['url_route']['kwargs']['stream_id']
+        self.frame_stream_id = numeric_stream_id(self.stream_id)
+        start_background_tasks()
         await self.accept()
         logger.info(f"WebSocket connected for stream {self.stream_id}")
 
@@ -25,122 +74,481 @@ class StreamConsumer(AsyncWebsocketConsumer):
         await self.stop_streaming()
         logger.info(f"WebSocket disconnected for stream {self.stream_id}")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
             data = json.loads(text_data)
             action = data.get('action')
 
             if action == 'start_stream':
                 rtsp_url = data.get('rtsp_url')
-                if rtsp_url:
-                    await self.start_streaming(rtsp_url)
+                transport = data.get('transport', TRANSPORT_JSON)
+                profile = data.get('profile')
+                rendition = data.get('rendition')
+                if transport not in TRANSPORTS:
+                    await self.send_error(f"Unsupported transport: {transport}")
+                elif profile is not None and profile not in PROFILES:
+                    await self.send_error(f"Unsupported profile: {profile}")
+                elif rendition is not None and rendition not in (*LADDER_RENDITIONS, RENDITION_AUTO):
+                    await self.send_error(f"Unsupported rendition: {rendition}")
+                elif rtsp_url:
+                    self.transport = transport
+                    await self.start_streaming(rtsp_url, profile, rendition)
             elif action == 'pause_stream':
                 await self.pause_streaming()
             elif action == 'resume_stream':
                 await self.resume_streaming()
             elif action == 'stop_stream':
                 await self.stop_streaming()
+            elif action == 'set_rendition':
+                await self.set_rendition(data.get('rendition'))
+            elif action == 'get_stats':
+                await self.send_stats()
 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, TypeError):
             await self.send_error("Invalid JSON data")
         except Exception as e:
             logger.error(f"Error in receive: {str(e)}")
             await self.send_error(f"Error processing request: {str(e)}")
 
-    async def start_streaming(self, rtsp_url):
+    async def start_streaming(self, rtsp_url, profile=None, rendition=None):
         try:
+            await self.stop_streaming()
             await self.send_status("connecting")
-            
-            # FFmpeg command to convert RTSP to HLS segments
-            ffmpeg_cmd = [
-                settings.FFMPEG_PATH,
-                '-i', rtsp_url,
-                '-c:v', 'libx264',
-                '-preset', 'ultrafast',
-                '-tune', 'zerolatency',
-                '-c:a', 'aac',
-                '-f', 'mp4',
-                '-movflags', 'frag_keyframe+empty_moov',
-                '-'
-            ]
-
-            self.ffmpeg_process = subprocess.Popen(
-                ffmpeg_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                bufsize=0
-            )
+            self.request = partial(self.start_streaming, rtsp_url, profile, rendition)
+            stream = await get_stream(self.stream_id)
+            if rendition is not None:
+                profile = PROFILE_LADDER
+            elif profile is None:
+                profile = await resolve_profile(stream, rtsp_url)
+            rendition, adaptive = starting_rendition(stream, profile, rendition)
 
-            self.is_streaming = True
-            self.streaming_task = asyncio.create_task(self.stream_video())
-            await self.send_status("connected")
+            # Viewers of the same camera and profile share one FFmpeg ingest
+            await self.attach(
+                lambda subscriber: hub.subscribe(
+                    rtsp_url, profile, subscriber, rendition, stream_priority(stream), stream_size(stream),
+                    stream_ingest_profile(stream),
+                ),
+                adaptive=adaptive,
+            )
+            if self.source.profile != profile:
+                await self.send_status(
+                    "degraded",
+                    profile=self.source.profile,
+                    requested_profile=profile,
+                    message=f"Server is busy; streaming with the {self.source.profile} profile instead",
+                )
 
+        except AdmissionRefused as e:
+            self.subscriber = None
+            logger.warning(f"Refused stream {self.stream_id}: {str(e)}")
+            await self.send_refused(e)
         except Exception as e:
+            self.subscriber = None
             logger.error(f"Error starting stream: {str(e)}")
             await self.send_error(f"Failed to start stream: {str(e)}")
 
+    async def attach(self, subscribe, adaptive=False, **status):
+        """Subscribe a fresh send queue through subscribe(subscriber) and start forwarding it"""
+        self.subscriber = Subscriber(
+            name=self.channel_name,
+            stream_id=self.stream_id,
+            max_bytes=settings.STREAM_CLIENT_QUEUE_MAX_BYTES,
+            max_fragments=settings.STREAM_CLIENT_QUEUE_MAX_FRAGMENTS,
+        )
+        self.subscriber.adaptive = adaptive
+        self.source = await subscribe(self.subscriber)
+
+        self.is_streaming = True
+        self.sequence = 0
+        self.announced_rendition = self.subscriber.rendition
+        self.streaming_task = asyncio.create_task(self.stream_video())
+        await self.send_status(
+            "connected",
+            transport=self.transport,
+            profile=self.source.profile,
+            rendition=self.subscriber.rendition,
+            **status
+        )
+
+    async def set_rendition(self, rendition):
+        if not self.source or not self.subscriber:
+            await self.send_error("No active stream")
+            return
+        if rendition == RENDITION_AUTO:
+            self.subscriber.adaptive = True
+            return
+        if rendition not in self.source.renditions:
+            await self.send_error(f"Unsupported rendition: {rendition}")
+            return
+        # Takes effect at the target rendition's next keyframe
+        self.subscriber.adaptive = False
+        self.source.request_switch(self.subscriber, rendition)
+
     async def stream_video(self):
         try:
-            while self.is_streaming and self.ffmpeg_process:
-                chunk = self.ffmpeg_process.stdout.read(8192)
-                if not chunk:
+            while self.is_streaming and self.subscriber:
+                item = await self.subscriber.get()
+                if item is None:
                     break
-                
-                # Encode chunk as base64 for WebSocket transmission
-                encoded_chunk = base64.b64encode(chunk).decode('utf-8')
-                await self.send(text_data=json.dumps({
-                    'type': 'stream_chunk',
-                    'chunk': encoded_chunk
-                }))
-                
-                await asyncio.sleep(0.01)  # Small delay to prevent overwhelming
+                chunk, flags = item
+                if flags & FLAG_INIT_SEGMENT and self.subscriber.rendition != self.announced_rendition:
+                    self.announced_rendition = self.subscriber.rendition
+                    await self.send_status("rendition_changed", rendition=self.announced_rendition)
+                await self.send_chunk(chunk, flags)
 
+        except asyncio.CancelledError:
+            # Whoever cancelled the task releases the subscription
+            raise
         except Exception as e:
             logger.error(f"Error in streaming: {str(e)}")
             await self.send_error(f"Streaming error: {str(e)}")
-        finally:
-            await self.stop_streaming()
+        await self.stop_streaming()
 
     async def pause_streaming(self):
-        self.is_streaming = False
+        """Leave the shared ingest so it can shut down if nobody else is watching
+
+        The ingest is kept for STREAM_PAUSE_GRACE_PERIOD seconds, so a quick resume
+        rejoins it and replays from its last keyframe instead of reconnecting the camera.
+        """
+        if not self.source:
+            await self.send_error("No active stream")
+            return
+        request = self.request
+        await self.release(getattr(settings, 'STREAM_PAUSE_GRACE_PERIOD', 30))
+        self.paused_request = request
         await self.send_status("paused")
 
     async def resume_streaming(self):
-        if self.ffmpeg_process and self.ffmpeg_process.poll() is None:
-            self.is_streaming = True
-            if not self.streaming_task or self.streaming_task.done():
-                self.streaming_task = asyncio.create_task(self.stream_video())
-            await self.send_status("connected")
+        if self.paused_request:
+            request, self.paused_request = self.paused_request, None
+            await request()
 
     async def stop_streaming(self):
+        self.paused_request = None
+        await self.release()
+
+    async def release(self, grace_period=None):
+        """Stop forwarding and unsubscribe, leaving the ingest to the hub after grace_period"""
         self.is_streaming = False
-        
-        if self.streaming_task:
+
+        # stream_video calls this once it ends; a task cannot await itself
+        if self.streaming_task and self.streaming_task is not asyncio.current_task():
             self.streaming_task.cancel()
             try:
                 await self.streaming_task
             except asyncio.CancelledError:
                 pass
+        self.streaming_task = None
 
-        if self.ffmpeg_process:
-            try:
-                self.ffmpeg_process.terminate()
-                self.ffmpeg_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.ffmpeg_process.kill()
-            except Exception as e:
-                logger.error(f"Error stopping FFmpeg process: {str(e)}")
-            finally:
-                self.ffmpeg_process = None
-
-    async def send_status(self, status):
+        if self.source:
+            source, self.source = self.source, None
+            await hub.unsubscribe(source, self.subscriber, grace_period)
+        self.subscriber = None
+
+    async def send_chunk(self, chunk, flags=0):
+        if self.transport == TRANSPORT_BINARY:
+            await self.send(bytes_data=encode_frame(self.frame_stream_id, self.sequence, chunk, flags))
+        else:
+            # Encode chunk as base64 for WebSocket transmission
+            encoded_chunk = base64.b64encode(chunk).decode('utf-8')
+            await self.send(text_data=json.dumps({
+                'type': 'stream_chunk',
+                'chunk': encoded_chunk
+            }))
+        self.sequence += 1
+
+    async def send_status(self, status, **extra):
         await self.send(text_data=json.dumps({
             'type': 'status',
-            'status': status
+            'status': status,
+            **extra
         }))
 
+    async def send_stats(self):
+        await self.send(text_data=json.dumps({
+            'type': 'stats',
+            'stats': self.subscriber.stats() if self.subscriber else None
+        }))
+
+    async def send_refused(self, error):
+        await self.send_status(
+            "refused",
+            message=str(error),
+            required_cores=round(error.required_cores, 2),
+            available_cores=round(error.available_cores, 2),
+        )
+
     async def send_error(self, message):
         await self.send(text_data=json.dumps({
             'type': 'error',
             'message': message
         }))
+
+
+class MosaicConsumer(StreamConsumer):
+    """Streams a server-composed grid of several cameras over a single socket"""
+
+    # StreamConsumer actions that also apply to a mosaic; start_stream would run a
+    # single-camera ingest beside it
+    SHARED_ACTIONS = ('pause_stream', 'resume_stream', 'stop_stream', 'get_stats')
+
+    async def connect(self):
+        self.stream_id = 'mosaic'
+        self.frame_stream_id = 0
+        start_background_tasks()
+        await self.accept()
+        logger.info("WebSocket connected for mosaic")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data)
+        except (json.JSONDecodeError, TypeError):
+            await self.send_error("Invalid JSON data")
+            return
+
+        action = data.get('action')
+        if action in self.SHARED_ACTIONS:
+            await super().receive(text_data, bytes_data)
+            return
+        if action != 'start_mosaic':
+            await self.send_error(f"Unsupported action for a mosaic: {action}")
+            return
+
+        transport = data.get('transport', TRANSPORT_JSON)
+        stream_ids = data.get('stream_ids') or []
+        if transport not in TRANSPORTS:
+            await self.send_error(f"Unsupported transport: {transport}")
+        elif not stream_ids or len(stream_ids) > settings.MOSAIC_MAX_TILES:
+            await self.send_error(f"A mosaic needs between 1 and {settings.MOSAIC_MAX_TILES} streams")
+        else:
+            self.transport = transport
+            await self.start_mosaic(stream_ids, data.get('layout', 'auto'))
+
+    async def start_mosaic(self, stream_ids, layout):
+        try:
+            await self.stop_streaming()
+            await self.send_status("connecting")
+            self.request = partial(self.start_mosaic, stream_ids, layout)
+            streams = await self.get_streams(stream_ids)
+            rtsp_urls = [stream.url for stream in streams]
+            priorities = {stream_priority(stream) for stream in streams}
+            priority = PRIORITY_HIGH if PRIORITY_HIGH in priorities else priorities.pop()
+            # Operators asking for the same cameras in the same layout share one composition
+            await self.attach(
+                lambda subscriber: hub.subscribe_mosaic(rtsp_urls, layout, subscriber, priority),
+                stream_ids=stream_ids,
+                layout=layout,
+            )
+        except AdmissionRefused as e:
+            self.subscriber = None
+            logger.warning(f"Refused mosaic: {str(e)}")
+            await self.send_refused(e)
+        except Exception as e:
+            self.subscriber = None
+            logger.error(f"Error starting mosaic: {str(e)}")
+            await self.send_error(f"Failed to start mosaic: {str(e)}")
+
+    @database_sync_to_async
+    def get_streams(self, stream_ids):
+        streams = Stream.objects.in_bulk([int(stream_id) for stream_id in stream_ids])
+        missing = [stream_id for stream_id in stream_ids if int(stream_id) not in streams]
+        if missing:
+            raise ValueError(f"Unknown streams: {missing}")
+        return [streams[int(stream_id)] for stream_id in stream_ids]
+
+
+class Subscription:
+    """One stream carried by a multiplexed socket"""
+
+    def __init__(self, stream_id, source, subscriber):
+        self.stream_id = stream_id
+        self.frame_stream_id = numeric_stream_id(stream_id)
+        self.source = source
+        self.subscriber = subscriber
+        self.sequence = 0
+        self.deficit = 0
+
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    """Carries many streams over one socket as binary frames tagged with their stream id
+
+    Streams are served by deficit round robin: each turn a stream earns a quantum of
+    bytes and may send whole fragments up to its balance, so a high-bitrate camera
+    gets its share of the socket but cannot starve the others.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.subscriptions = {}
+        self.wakeup = asyncio.Event()
+        self.sending_task = None
+
+    async def connect(self):
+        start_background_tasks()
+        await self.accept()
+        self.sending_task = asyncio.create_task(self.send_loop())
+        logger.info("Multiplexed WebSocket connected")
+
+    async def disconnect(self, close_code):
+        if self.sending_task:
+            self.sending_task.cancel()
+            try:
+                await self.sending_task
+            except asyncio.CancelledError:
+                pass
+        for stream_id in list(self.subscriptions):
+            await self.unsubscribe(stream_id)
+        logger.info("Multiplexed WebSocket disconnected")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data)
+            action = data.get('action')
+            stream_id = str(data.get('stream_id', ''))
+
+            if action == 'subscribe':
+                await self.subscribe(stream_id, data.get('rtsp_url'), data.get('profile'), data.get('rendition'))
+            elif action == 'unsubscribe':
+                await self.unsubscribe(stream_id)
+                await self.send_status("unsubscribed", stream_id)
+            elif action == 'get_stats':
+                await self.send(text_data=json.dumps({
+                    'type': 'stats',
+                    'stats': [sub.subscriber.stats() for sub in self.subscriptions.values()]
+                }))
+
+        except (json.JSONDecodeError, TypeError):
+            await self.send_error("Invalid JSON data")
+        except Exception as e:
+            logger.error(f"Error in multiplexed receive: {str(e)}")
+            await self.send_error(f"Error processing request: {str(e)}")
+
+    async def subscribe(self, stream_id, rtsp_url=None, profile=None, rendition=None):
+        if not stream_id:
+            await self.send_error("stream_id is required")
+            return
+        if stream_id in self.subscriptions:
+            await self.unsubscribe(stream_id)
+        if profile is not None and profile not in PROFILES:
+            await self.send_error(f"Unsupported profile: {profile}", stream_id)
+            return
+
+        try:
+            stream = await get_stream(stream_id)
+            rtsp_url = rtsp_url or (stream.url if stream else None)
+            if not rtsp_url:
+                await self.send_error("Unknown stream", stream_id)
+                return
+            if rendition is not None:
+                profile = PROFILE_LADDER
+            elif profile is None:
+                profile = await resolve_profile(stream, rtsp_url)
+            rendition, adaptive = starting_rendition(stream, profile, rendition)
+
+            subscriber = Subscriber(
+                name=self.channel_name,
+                stream_id=stream_id,
+                max_bytes=settings.STREAM_CLIENT_QUEUE_MAX_BYTES,
+                max_fragments=settings.STREAM_CLIENT_QUEUE_MAX_FRAGMENTS,
+                notify=self.wakeup.set,
+            )
+            subscriber.adaptive = adaptive
+            source = await hub.subscribe(
+                rtsp_url, profile, subscriber, rendition, stream_priority(stream), stream_size(stream),
+                stream_ingest_profile(stream),
+            )
+        except AdmissionRefused as e:
+            logger.warning(f"Refused stream {stream_id}: {str(e)}")
+            await self.send_status(
+                "refused", stream_id,
+                message=str(e),
+                required_cores=round(e.required_cores, 2),
+                available_cores=round(e.available_cores, 2),
+            )
+            return
+        except Exception as e:
+            logger.error(f"Error subscribing to stream {stream_id}: {str(e)}")
+            await self.send_error(f"Failed to start stream: {str(e)}", stream_id)
+            return
+
+        subscription = Subscription(stream_id, source, subscriber)
+        self.subscriptions[stream_id] = subscription
+        await self.send_status(
+            "connected", stream_id,
+            frame_stream_id=subscription.frame_stream_id, profile=source.profile, rendition=subscriber.rendition,
+        )
+        if source.profile != profile:
+            await self.send_status(
+                "degraded", stream_id,
+                profile=source.profile,
+                requested_profile=profile,
+                message=f"Server is busy; streaming with the {source.profile} profile instead",
+            )
+        self.wakeup.set()
+
+    async def unsubscribe(self, stream_id):
+        subscription = self.subscriptions.pop(stream_id, None)
+        if subscription:
+            await hub.unsubscribe(subscription.source, subscription.subscriber)
+
+    async def send_loop(self):
+        quantum = settings.STREAM_MUX_QUANTUM
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            active = True
+            while active:
+                active = False
+                for subscription in list(self.subscriptions.values()):
+                    subscriber = subscription.subscriber
+                    if subscriber.next_size is None:
+                        subscription.deficit = 0
+                        if subscriber.closed and self.subscriptions.get(subscription.stream_id) is subscription:
+                            await self.unsubscribe(subscription.stream_id)
+                            await self.send_status("ended", subscription.stream_id)
+                        continue
+
+                    subscription.deficit += quantum
+                    while subscriber.next_size is not None and subscriber.next_size <= subscription.deficit:
+                        data, flags = subscriber.get_nowait()
+                        subscription.deficit -= len(data)
+                        await self.send(bytes_data=encode_frame(
+                            subscription.frame_stream_id, subscription.sequence, data, flags
+                        ))
+                        subscription.sequence += 1
+                    if subscriber.next_size is not None:
+                        active = True
+
+    async def send_status(self, status, stream_id, **extra):
+        await self.send(text_data=json.dumps({
+            'type': 'status',
+            'status': status,
+            'stream_id': stream_id,
+            **extra
+        }))
+
+    async def send_error(self, message, stream_id=None):
+        await self.send(text_data=json.dumps({
+            'type': 'error',
+            'message': message,
+            'stream_id': stream_id
+        }))
+
+
+class StatusConsumer(AsyncWebsocketConsumer):
+    """Pushes is_active changes found by the liveness sweeper, so dashboards need not poll"""
+
+    async def connect(self):
+        sweeper.ensure_started()
+        await self.channel_layer.group_add(STATUS_GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(STATUS_GROUP, self.channel_name)
+
+    async def stream_status(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'status',
+            'transitions': event['transitions']
+        }))
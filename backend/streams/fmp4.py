@@ -0,0 +1,332 @@
+import struct
+from collections import deque
+from .buffer import Fragment
+
+BOX_HEADER = struct.Struct('>I4s')
+U32 = struct.Struct('>I')
+U64 = struct.Struct('>Q')
+
+# tfhd flags
+TFHD_BASE_DATA_OFFSET = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX = 0x000002
+TFHD_DEFAULT_SAMPLE_DURATION = 0x000008
+TFHD_DEFAULT_SAMPLE_SIZE = 0x000010
+TFHD_DEFAULT_SAMPLE_FLAGS = 0x000020
+
+# trun flags
+TRUN_DATA_OFFSET = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS = 0x000004
+TRUN_SAMPLE_DURATION = 0x000100
+TRUN_SAMPLE_SIZE = 0x000200
+TRUN_SAMPLE_FLAGS = 0x000400
+TRUN_SAMPLE_COMPOSITION_TIME_OFFSET = 0x000800
+
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+
+class Track:
+    """Per-track values from the init segment needed to interpret fragments"""
+
+    __slots__ = ('track_id', 'timescale', 'handler', 'width', 'height', 'default_duration', 'default_flags')
+
+    def __init__(self, track_id):
+        self.track_id = track_id
+        self.timescale = None
+        self.handler = None
+        self.width = None
+        self.height = None
+        self.default_duration = 0
+        self.default_flags = 0
+
+
+class StreamStatistics:
+    """Frame rate, bitrate and GOP length derived from fragment headers over a sliding window"""
+
+    def __init__(self, window=30):
+        self.window = deque(maxlen=window)
+        self.frames = 0
+        self.last_keyframe = None
+        self.gop_frames = None
+        self.decode_time = None
+
+    def add(self, frames, seconds, size, sync_samples, decode_time=None):
+        self.window.append((frames, seconds, size))
+        for index in sync_samples:
+            position = self.frames + index
+            if self.last_keyframe is not None:
+                self.gop_frames = position - self.last_keyframe
+            self.last_keyframe = position
+        self.frames += frames
+        if decode_time is not None:
+            self.decode_time = decode_time
+
+    @property
+    def fps(self):
+        seconds = sum(entry[1] for entry in self.window)
+        if not seconds:
+            return None
+        return sum(entry[0] for entry in self.window) / seconds
+
+    @property
+    def bitrate(self):
+        """Bits per second over the window, container overhead included"""
+        seconds = sum(entry[1] for entry in self.window)
+        if not seconds:
+            return None
+        return sum(entry[2] for entry in self.window) * 8 / seconds
+
+    def as_dict(self):
+        fps = self.fps
+        bitrate = self.bitrate
+        return {
+            'fps': round(fps, 2) if fps else None,
+            'bitrate_kbps': round(bitrate / 1000) if bitrate else None,
+            'gop_frames': self.gop_frames,
+            'gop_seconds': round(self.gop_frames / fps, 3) if self.gop_frames and fps else None,
+            'frames': self.frames,
+            'decode_time': self.decode_time,
+        }
+
+
+class FragmentParser:
+    """Incremental ISO-BMFF parser for FFmpeg's fragmented MP4 output
+
+    Chunks are appended to one reusable bytearray and boxes are walked in place through
+    a memoryview, so the only copy made is the one that hands a finished unit to the
+    subscribers. feed() returns ('init', bytes) for the ftyp+moov init segment and
+    ('fragment', Fragment) for every complete moof+mdat, tagged as keyframe or not from
+    the video track's sample flags.
+    """
+
+    def __init__(self, initial_size=1024 * 1024):
+        self.buffer = bytearray(initial_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first byte of the unit being assembled
+        self.scan = 0   # next top-level box header
+        self.end = 0    # end of valid data
+        self.tracks = {}
+        self.video_track = None
+        self.moof = None
+        self.statistics = StreamStatistics()
+
+    def feed(self, chunk):
+        self._append(chunk)
+        units = []
+        view = self.view
+        while True:
+            header = self._box_header(self.scan, self.end)
+            if header is None:
+                break
+            box_type, body, box_end = header
+            if box_end > self.end:
+                break
+
+            if box_type == b'moov':
+                self._parse_moov(body, box_end)
+                units.append(('init', bytes(view[self.start:box_end])))
+                self.start = box_end
+            elif box_type == b'moof':
+                self.moof = self._parse_moof(body, box_end)
+            elif box_type == b'mdat':
+                units.append(('fragment', self._fragment(box_end)))
+                self.start = box_end
+            self.scan = box_end
+
+        if self.start == self.end:
+            self.start = self.scan = self.end = 0
+        return units
+
+    def _append(self, chunk):
+        size = len(chunk)
+        if self.end + size > len(self.buffer):
+            pending = self.end - self.start
+            if pending + size > len(self.buffer):
+                # A single box larger than the buffer: grow once and keep the new size
+                self.view.release()
+                grown = bytearray(max(len(self.buffer) * 2, pending + size))
+                grown[:pending] = self.buffer[self.start:self.end]
+                self.buffer = grown
+                self.view = memoryview(self.buffer)
+            elif pending:
+                self.buffer[:pending] = bytes(self.view[self.start:self.end])
+            self.scan -= self.start
+            self.end = pending
+            self.start = 0
+        self.buffer[self.end:self.end + size] = chunk
+        self.end += size
+
+    def _box_header(self, offset, limit):
+        if limit - offset < BOX_HEADER.size:
+            return None
+        size, box_type = BOX_HEADER.unpack_from(self.buffer, offset)
+        body = offset + BOX_HEADER.size
+        if size == 1:
+            if limit - offset < BOX_HEADER.size + U64.size:
+                return None
+            size, = U64.unpack_from(self.buffer, body)
+            body += U64.size
+        elif size == 0:
+            raise ValueError(f"Unbounded {box_type!r} box in a live stream")
+        if size < body - offset:
+            raise ValueError(f"Invalid MP4 box size {size} for {box_type!r}")
+        return box_type, body, offset + size
+
+    def _children(self, start, end):
+        offset = start
+        while offset < end:
+            header = self._box_header(offset, end)
+            if header is None:
+                return
+            yield header
+            offset = header[2]
+
+    def _parse_moov(self, start, end):
+        self.tracks = {}
+        self.video_track = None
+        for box_type, body, box_end in self._children(start, end):
+            if box_type == b'trak':
+                self._parse_trak(body, box_end)
+            elif box_type == b'mvex':
+                for child_type, child_body, _ in self._children(body, box_end):
+                    if child_type == b'trex':
+                        track_id, _, duration, _, flags = struct.unpack_from('>5I', self.buffer, child_body + 4)
+                        track = self.tracks.setdefault(track_id, Track(track_id))
+                        track.default_duration = duration
+                        track.default_flags = flags
+
+        for track in self.tracks.values():
+            if track.handler == b'vide':
+                self.video_track = track
+                break
+
+    def _parse_trak(self, start, end):
+        track = None
+        for box_type, body, box_end in self._children(start, end):
+            if box_type == b'tkhd':
+                version = self.buffer[body]
+                track_id, = U32.unpack_from(self.buffer, body + (20 if version == 1 else 12))
+                track = self.tracks.setdefault(track_id, Track(track_id))
+                # 16.16 fixed-point presentation size closes the box
+                width, height = struct.unpack_from('>II', self.buffer, body + (88 if version == 1 else 76))
+                track.width, track.height = width >> 16, height >> 16
+            elif box_type == b'mdia' and track is not None:
+                for child_type, child_body, _ in self._children(body, box_end):
+                    if child_type == b'mdhd':
+                        version = self.buffer[child_body]
+                        track.timescale, = U32.unpack_from(self.buffer, child_body + (20 if version == 1 else 12))
+                    elif child_type == b'hdlr':
+                        track.handler = bytes(self.view[child_body + 8:child_body + 12])
+
+    def _parse_moof(self, start, end):
+        """Return (keyframe, frames, duration ticks, sync sample indexes, decode time) of the video track"""
+        video = self.video_track
+        for box_type, body, box_end in self._children(start, end):
+            if box_type != b'traf':
+                continue
+            result = self._parse_traf(body, box_end, video)
+            if result is not None:
+                return result
+        return None
+
+    def _parse_traf(self, start, end, video):
+        buffer = self.buffer
+        track = None
+        default_duration = default_flags = 0
+        decode_time = None
+        frames = duration = 0
+        sync_samples = []
+
+        for box_type, body, box_end in self._children(start, end):
+            if box_type == b'tfhd':
+                flags, = U32.unpack_from(buffer, body)
+                flags &= 0xFFFFFF
+                track_id, = U32.unpack_from(buffer, body + 4)
+                if video is not None and track_id != video.track_id:
+                    return None
+                track = self.tracks.get(track_id) or Track(track_id)
+                default_duration = track.default_duration
+                default_flags = track.default_flags
+                offset = body + 8
+                if flags & TFHD_BASE_DATA_OFFSET:
+                    offset += 8
+                if flags & TFHD_SAMPLE_DESCRIPTION_INDEX:
+                    offset += 4
+                if flags & TFHD_DEFAULT_SAMPLE_DURATION:
+                    default_duration, = U32.unpack_from(buffer, offset)
+                    offset += 4
+                if flags & TFHD_DEFAULT_SAMPLE_SIZE:
+                    offset += 4
+                if flags & TFHD_DEFAULT_SAMPLE_FLAGS:
+                    default_flags, = U32.unpack_from(buffer, offset)
+            elif box_type == b'tfdt':
+                if buffer[body] == 1:
+                    decode_time, = U64.unpack_from(buffer, body + 4)
+                else:
+                    decode_time, = U32.unpack_from(buffer, body + 4)
+            elif box_type == b'trun':
+                run_frames, run_duration = self._parse_trun(
+                    body, default_duration, default_flags, frames, sync_samples
+                )
+                frames += run_frames
+                duration += run_duration
+
+        if track is None:
+            return None
+        return bool(sync_samples) and sync_samples[0] == 0, frames, duration, sync_samples, decode_time
+
+    def _parse_trun(self, body, default_duration, default_flags, first_index, sync_samples):
+        buffer = self.buffer
+        flags, count = struct.unpack_from('>II', buffer, body)
+        flags &= 0xFFFFFF
+        offset = body + 8
+        if flags & TRUN_DATA_OFFSET:
+            offset += 4
+        first_flags = None
+        if flags & TRUN_FIRST_SAMPLE_FLAGS:
+            first_flags, = U32.unpack_from(buffer, offset)
+            offset += 4
+
+        per_sample = (TRUN_SAMPLE_DURATION, TRUN_SAMPLE_SIZE, TRUN_SAMPLE_FLAGS, TRUN_SAMPLE_COMPOSITION_TIME_OFFSET)
+        fields = [field for field in per_sample if flags & field]
+        if TRUN_SAMPLE_DURATION not in fields and TRUN_SAMPLE_FLAGS not in fields:
+            # Fast path: every sample shares the defaults, only the first may differ
+            sample_flags = default_flags if first_flags is None else first_flags
+            if count and not sample_flags & SAMPLE_IS_NON_SYNC:
+                sync_samples.append(first_index)
+            if not default_flags & SAMPLE_IS_NON_SYNC:
+                sync_samples.extend(range(first_index + 1, first_index + count))
+            return count, count * default_duration
+
+        stride = 4 * len(fields)
+        duration_at = fields.index(TRUN_SAMPLE_DURATION) * 4 if TRUN_SAMPLE_DURATION in fields else None
+        flags_at = fields.index(TRUN_SAMPLE_FLAGS) * 4 if TRUN_SAMPLE_FLAGS in fields else None
+        duration = 0
+        for index in range(count):
+            if duration_at is None:
+                duration += default_duration
+            else:
+                duration += U32.unpack_from(buffer, offset + duration_at)[0]
+            if index == 0 and first_flags is not None:
+                sample_flags = first_flags
+            elif flags_at is not None:
+                sample_flags = U32.unpack_from(buffer, offset + flags_at)[0]
+            else:
+                sample_flags = default_flags
+            if not sample_flags & SAMPLE_IS_NON_SYNC:
+                sync_samples.append(first_index + index)
+            offset += stride
+        return count, duration
+
+    def _fragment(self, end):
+        data = bytes(self.view[self.start:end])
+        moof, self.moof = self.moof, None
+        if moof is None:
+            # No video track information; FFmpeg's frag_keyframe still starts every fragment on one
+            return Fragment(data)
+
+        keyframe, frames, ticks, sync_samples, decode_time = moof
+        timescale = self.video_track.timescale if self.video_track else None
+        seconds = ticks / timescale if timescale else None
+        if seconds:
+            self.statistics.add(frames, seconds, len(data), sync_samples, decode_time)
+        return Fragment(data, keyframe=keyframe, frames=frames, duration=seconds)
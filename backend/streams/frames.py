@@ -0,0 +1,37 @@
+import struct
+import zlib
+
+# Binary media frames: a fixed 12 byte header followed by the payload.
+#   version (u8) | flags (u8) | reserved (u16) | stream id (u32) | sequence (u32)
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('!BBHII')
+
+FLAG_INIT_SEGMENT = 0x01
+FLAG_KEYFRAME = 0x02
+FLAG_FRAGMENT_START = 0x04
+FLAG_FRAGMENT_END = 0x08
+
+TRANSPORT_JSON = 'json'
+TRANSPORT_BINARY = 'binary'
+TRANSPORTS = (TRANSPORT_JSON, TRANSPORT_BINARY)
+
+
+def numeric_stream_id(stream_id):
+    """Map a route stream id onto the u32 carried in the frame header"""
+    stream_id = str(stream_id)
+    if stream_id.isdigit() and int(stream_id) < 2 ** 32:
+        return int(stream_id)
+    return zlib.crc32(stream_id.encode('utf-8'))
+
+
+def encode_frame(stream_id, sequence, payload, flags=0):
+    header = FRAME_HEADER.pack(FRAME_VERSION, flags, 0, stream_id, sequence & 0xFFFFFFFF)
+    return header + payload
+
+
+def decode_frame(frame):
+    """Return (stream_id, sequence, flags, payload) for a binary frame"""
+    version, flags, _, stream_id, sequence = FRAME_HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    return stream_id, sequence, flags, memoryview(frame)[FRAME_HEADER.size:]
@@ -0,0 +1,527 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from django.conf import settings
+from .buffer import FragmentRingBuffer
+from .fmp4 import FragmentParser
+from .frames import FLAG_FRAGMENT_END, FLAG_FRAGMENT_START, FLAG_INIT_SEGMENT, FLAG_KEYFRAME
+from .profiles import (
+    INGEST_DEFAULT, PROFILE_PASSTHROUGH, PROFILE_TRANSCODE, RENDITION_SOURCE, build_ffmpeg_command, build_mosaic_command,
+    estimate_cpu_cores, parse_layout, profile_renditions,
+)
+from .scheduler import PRIORITY_NORMAL, TranscodeScheduler, degrade_chain
+from .startup import record_startup, startup_timings
+from .supervisor import IngestSupervisor
+from .telemetry import registry
+from .timeseries import history
+
+logger = logging.getLogger(__name__)
+
+
+def redact_url(url):
+    """Strip credentials from an RTSP URL before it is logged or reported"""
+    return re.sub(r'//[^/@]+@', '//***@', url)
+
+
+def fragment_flags(fragment):
+    flags = FLAG_FRAGMENT_START | FLAG_FRAGMENT_END
+    if fragment.keyframe:
+        flags |= FLAG_KEYFRAME
+    return flags
+
+
+class Rendition:
+    """One published track of a source with its own parser, late-join buffer and viewers"""
+
+    def __init__(self, source, name, output):
+        self.source = source
+        self.name = name
+        self.output = output
+        self.parser = FragmentParser()
+        self.buffer = FragmentRingBuffer(
+            max_fragments=getattr(settings, 'STREAM_BUFFER_MAX_FRAGMENTS', 8),
+            max_bytes=getattr(settings, 'STREAM_BUFFER_MAX_BYTES', 8 * 1024 * 1024),
+            max_duration=getattr(settings, 'STREAM_BUFFER_MAX_SECONDS', 10.0),
+        )
+        self.subscribers = set()
+        # Viewers moving here from another rendition; they cut over on the next keyframe
+        self.switching = set()
+        self.last_keyframe_at = None
+
+    def reset(self):
+        """Forget parser state before a replacement process starts writing a new init segment"""
+        self.parser = FragmentParser()
+        self.last_keyframe_at = None
+
+    def feed(self, chunk):
+        for kind, unit in self.parser.feed(chunk):
+            self.handle(kind, unit)
+
+    def handle(self, kind, unit):
+        if kind == 'init':
+            self.source.reached('init_segment')
+            self.buffer.set_init_segment(unit)
+            self._publish(unit, FLAG_INIT_SEGMENT)
+        else:
+            if unit.keyframe:
+                self.source.reached('keyframe')
+                self.last_keyframe_at = time.monotonic()
+            self.buffer.append(unit)
+            if unit.keyframe and self.switching:
+                self._complete_switches()
+            self._publish(unit.data, fragment_flags(unit))
+
+    def next_keyframe_in(self):
+        """Seconds until the encoder's next regular keyframe, or None while the GOP is unknown"""
+        gop_seconds = self.parser.statistics.as_dict()['gop_seconds']
+        if gop_seconds is None or self.last_keyframe_at is None:
+            return None
+        return max(gop_seconds - (time.monotonic() - self.last_keyframe_at), 0.0)
+
+    def _complete_switches(self):
+        for subscriber in tuple(self.switching):
+            previous = self.source.renditions.get(subscriber.rendition)
+            if previous is not None:
+                previous.subscribers.discard(subscriber)
+            subscriber.rendition = self.name
+            subscriber.deliver(self.buffer.init_segment, FLAG_INIT_SEGMENT)
+            self.subscribers.add(subscriber)
+        self.switching.clear()
+
+    def _publish(self, data, flags):
+        for subscriber in tuple(self.subscribers):
+            skips = subscriber.skips
+            subscriber.deliver(data, flags)
+            if subscriber.adaptive and subscriber.skips != skips:
+                self.source.step_down(subscriber)
+
+    def add_subscriber(self, subscriber):
+        # Replay the init segment and the current GOP so the viewer can decode immediately
+        init_segment, fragments = self.buffer.late_join()
+        if init_segment is not None:
+            subscriber.deliver(init_segment, FLAG_INIT_SEGMENT)
+        for fragment in fragments:
+            subscriber.deliver(fragment.data, fragment_flags(fragment))
+        subscriber.rendition = self.name
+        self.subscribers.add(subscriber)
+
+    def stats(self):
+        video = self.parser.video_track
+        return {
+            'name': self.name,
+            'resolution': f"{video.width}x{video.height}" if video and video.width else None,
+            'buffered_fragments': len(self.buffer.fragments),
+            'buffered_bytes': self.buffer.size,
+            'media': self.parser.statistics.as_dict(),
+            'subscribers': [subscriber.stats() for subscriber in tuple(self.subscribers)],
+        }
+
+
+class StreamSource:
+    """A single FFmpeg ingest for one camera and profile, fanned out to every subscriber"""
+
+    def __init__(self, hub, key, command, renditions, ingest_profile=None):
+        self.hub = hub
+        self.key = key
+        self.ingest_profile = ingest_profile
+        self.renditions = {name: Rendition(self, name, index) for index, name in enumerate(renditions)}
+        self.rendition_list = list(self.renditions.values())
+        # Viewers stay attached across restarts; the new init segment is spliced into their queues
+        self.ingest = IngestSupervisor(
+            command,
+            outputs=len(self.rendition_list),
+            on_chunk=self._feed,
+            on_restart=self._reset,
+            on_exit=lambda: self.hub._source_ended(self),
+            label=f"ingest for {redact_url(key[0])} ({key[1]})",
+            stall_timeout=getattr(settings, 'STREAM_STALL_TIMEOUT', 10.0),
+            backoff_base=getattr(settings, 'STREAM_RESTART_BACKOFF_BASE', 0.25),
+            backoff_max=getattr(settings, 'STREAM_RESTART_BACKOFF_MAX', 30.0),
+            max_attempts=getattr(settings, 'STREAM_RESTART_MAX_ATTEMPTS', 0),
+            on_progress=self._progress,
+        )
+        # FFmpeg progress of the running ingest, published in the telemetry registry
+        self.metrics = None
+        self.teardown_handle = None
+        # Pinned sources are kept running without viewers; prewarmed ones were started that way
+        self.pinned = False
+        self.prewarmed = False
+        self.cost = 0
+        # Startup milestones of the current FFmpeg process and the timings of the last complete start
+        self.milestones = {}
+        self.startup = None
+        self.last_keyframe_request = None
+
+    @property
+    def profile(self):
+        return self.key[1]
+
+    @property
+    def running(self):
+        return self.ingest.running
+
+    @property
+    def primary(self):
+        return next(iter(self.renditions.values()))
+
+    @property
+    def subscribers(self):
+        subscribers = set()
+        for rendition in self.renditions.values():
+            subscribers.update(rendition.subscribers)
+        return subscribers
+
+    async def start(self):
+        await self.ingest.start()
+        self.metrics = registry.register(self.key)
+
+    def _feed(self, output, chunk):
+        self.rendition_list[output].feed(chunk)
+
+    def _progress(self, report):
+        if self.metrics:
+            self.metrics.update(report)
+            # Mosaics mix several cameras and get no history of their own
+            if self.ingest_profile is not None:
+                history.record(self.key[0], self.metrics.as_dict())
+
+    def _reset(self):
+        if self.metrics:
+            self.metrics.restarted()
+        self.milestones = {}
+        for rendition in self.rendition_list:
+            rendition.reset()
+
+    def reached(self, milestone):
+        """Note when the current process first reached a startup milestone"""
+        if milestone in self.milestones:
+            return
+        self.milestones[milestone] = time.monotonic()
+        if milestone != 'keyframe':
+            return
+        ffmpeg = self.ingest.ingest
+        self.milestones['connect'] = ffmpeg.input_opened_at
+        self.milestones['first_byte'] = ffmpeg.first_byte_at
+        self.startup = startup_timings(ffmpeg.started_at, self.milestones)
+        logger.info(f"Startup of {redact_url(self.key[0])} ({self.ingest_profile or self.profile}): {self.startup}")
+        self.hub._startup_measured(self)
+
+    def request_keyframe(self):
+        """Start a replacement transcode so a joining viewer gets an IDR now rather than next GOP
+
+        FFmpeg cannot be told to force a keyframe while it runs, so a second process is
+        started beside the live one and takes over once it has written its opening
+        keyframe; viewers get its init segment and carry on. Requests are rate-limited
+        and skipped when the regular keyframe is due sooner than a replacement could start.
+
+        The replacement is a second encoder and a second session to the camera while it
+        runs, so it must fit the CPU budget like any ingest. Mosaics are never replaced:
+        that would pull every one of their cameras again.
+        """
+        if self.profile == PROFILE_PASSTHROUGH or self.profile.startswith('mosaic-'):
+            return False
+        now = time.monotonic()
+        min_interval = getattr(settings, 'STREAM_KEYFRAME_MIN_INTERVAL', 10.0)
+        if self.last_keyframe_request is not None and now - self.last_keyframe_request < min_interval:
+            return False
+        wait = self.primary.next_keyframe_in()
+        startup = (self.startup or {}).get('keyframe')
+        if wait is not None and startup is not None and wait <= startup:
+            return False
+
+        # Held until the replacement is promoted or dropped
+        scheduler = self.hub.scheduler
+        reservation = (*self.key, 'keyframe')
+        if not scheduler.admit(reservation, self.cost):
+            return False
+        staging = [(FragmentParser(), []) for _ in self.rendition_list]
+        timeout = getattr(settings, 'STREAM_KEYFRAME_REPLACE_TIMEOUT', 10.0)
+        if not self.ingest.replace(lambda output, chunk: self._stage(staging, output, chunk), timeout):
+            scheduler.release(reservation)
+            return False
+        self.ingest.replace_task.add_done_callback(lambda task: scheduler.release(reservation))
+        self.last_keyframe_request = now
+        return True
+
+    def _stage(self, staging, output, chunk):
+        parser, units = staging[output]
+        units.extend(parser.feed(chunk))
+        if not all(any(kind == 'fragment' and unit.keyframe for kind, unit in staged) for _, staged in staging):
+            return
+        # Every output has its opening keyframe: cut viewers over to the replacement
+        self.ingest.promote()
+        for rendition, (parser, staged) in zip(self.rendition_list, staging):
+            rendition.parser = parser
+            for kind, unit in staged:
+                rendition.handle(kind, unit)
+
+    def add_subscriber(self, subscriber, rendition=None):
+        if rendition is None:
+            rendition = self.primary.name
+        if rendition not in self.renditions:
+            raise ValueError(f"Unknown rendition: {rendition}")
+        self.renditions[rendition].add_subscriber(subscriber)
+
+    def remove_subscriber(self, subscriber):
+        for rendition in self.renditions.values():
+            rendition.subscribers.discard(subscriber)
+            rendition.switching.discard(subscriber)
+
+    def request_switch(self, subscriber, rendition):
+        """Move a viewer to another rendition at that rendition's next keyframe"""
+        if rendition not in self.renditions:
+            raise ValueError(f"Unknown rendition: {rendition}")
+        for candidate in self.renditions.values():
+            candidate.switching.discard(subscriber)
+        if rendition != subscriber.rendition:
+            self.renditions[rendition].switching.add(subscriber)
+
+    def step_down(self, subscriber):
+        """Adaptive viewers that had to skip media move one rendition down the ladder"""
+        names = list(self.renditions)
+        if subscriber.rendition in names:
+            index = names.index(subscriber.rendition)
+            if index + 1 < len(names):
+                self.request_switch(subscriber, names[index + 1])
+
+    def cpu_stats(self):
+        """Measured FFmpeg CPU use, and for passthrough the estimated saving over a transcode"""
+        cpu_percent = self.ingest.cpu_percent()
+        stats = {'cpu_percent': round(cpu_percent, 1) if cpu_percent is not None else None}
+        video = self.primary.parser.video_track
+        fps = self.primary.parser.statistics.fps
+        if self.profile == PROFILE_PASSTHROUGH and video and video.width and fps:
+            transcode_cores = estimate_cpu_cores(PROFILE_TRANSCODE, video.width, video.height, fps)
+            used_cores = cpu_percent / 100 if cpu_percent is not None else estimate_cpu_cores(PROFILE_PASSTHROUGH)
+            stats['cpu_saved_cores'] = round(max(transcode_cores - used_cores, 0), 2)
+        return stats
+
+    def stats(self):
+        return {
+            'url': redact_url(self.key[0]),
+            'profile': self.profile,
+            'running': self.running,
+            'pinned': self.pinned,
+            'ingest_profile': self.ingest_profile,
+            'startup': self.startup,
+            'metrics': self.metrics.as_dict() if self.metrics else None,
+            **self.ingest.stats(),
+            **self.cpu_stats(),
+            'renditions': [rendition.stats() for rendition in self.renditions.values()],
+        }
+
+    async def stop(self):
+        if self.teardown_handle:
+            self.teardown_handle.cancel()
+            self.teardown_handle = None
+        if self.metrics:
+            registry.unregister(self.key, self.metrics)
+        await self.ingest.stop()
+        for subscriber in self.subscribers:
+            subscriber.close()
+        for rendition in self.renditions.values():
+            rendition.subscribers.clear()
+            rendition.switching.clear()
+
+
+class StreamHub:
+    """Process-wide registry of shared stream sources keyed by RTSP URL and profile"""
+
+    def __init__(self, grace_period=None, scheduler=None):
+        if grace_period is None:
+            grace_period = getattr(settings, 'STREAM_HUB_GRACE_PERIOD', 10)
+        if scheduler is None:
+            scheduler = TranscodeScheduler(
+                getattr(settings, 'STREAM_CPU_BUDGET', os.cpu_count() or 1),
+                getattr(settings, 'STREAM_PRIORITY_RESERVE', 0.25),
+            )
+        self.grace_period = grace_period
+        self.scheduler = scheduler
+        self.sources = {}
+        self.lock = asyncio.Lock()
+        # First viewers of a camera that found its ingest already running, and those that had to wait
+        self.warm_joins = 0
+        self.cold_joins = 0
+        self.prewarm_hits = 0
+
+    async def subscribe(self, rtsp_url, profile, subscriber, rendition=None, priority=PRIORITY_NORMAL, size=None,
+                        ingest_profile=INGEST_DEFAULT):
+        """Attach a subscriber to the ingest for this camera, degrading the profile if CPU is short
+
+        The returned source's profile may be cheaper than the one requested.
+        """
+        if rendition is not None and rendition not in profile_renditions(profile):
+            raise ValueError(f"Unknown rendition for {profile}: {rendition}")
+        candidates = [
+            (
+                (rtsp_url, candidate),
+                lambda candidate=candidate: build_ffmpeg_command(rtsp_url, candidate, ingest_profile),
+                profile_renditions(candidate),
+                self.scheduler.estimate(candidate, size),
+            )
+            for candidate in degrade_chain(profile)
+        ]
+        return await self.subscribe_source(candidates, subscriber, rendition, priority, ingest_profile)
+
+    async def subscribe_mosaic(self, rtsp_urls, layout, subscriber, priority=PRIORITY_NORMAL):
+        """Share one composed grid between every viewer asking for the same cameras and layout"""
+        columns, rows = parse_layout(layout, len(rtsp_urls))
+        key = (' | '.join(rtsp_urls), f'mosaic-{columns}x{rows}')
+        cost = self.scheduler.estimate_mosaic(
+            getattr(settings, 'MOSAIC_WIDTH', 1920),
+            getattr(settings, 'MOSAIC_HEIGHT', 1080),
+            getattr(settings, 'MOSAIC_FPS', 15),
+        )
+        return await self.subscribe_source(
+            [(key, lambda: build_mosaic_command(rtsp_urls, columns, rows), (RENDITION_SOURCE,), cost)],
+            subscriber,
+            priority=priority,
+        )
+
+    async def subscribe_source(self, candidates, subscriber, rendition=None, priority=PRIORITY_NORMAL,
+                               ingest_profile=None):
+        """Attach a subscriber to the first candidate source that is running or fits the CPU budget
+
+        Candidates are (key, build_command, renditions, cost) tuples ordered from the
+        requested ingest to its cheapest fallback; new sources run build_command().
+        """
+        async with self.lock:
+            for index, (key, build_command, renditions, cost) in enumerate(candidates):
+                source = self.sources.get(key)
+                if source is not None:
+                    if source.teardown_handle:
+                        source.teardown_handle.cancel()
+                        source.teardown_handle = None
+                    if not source.subscribers:
+                        self.warm_joins += 1
+                        if source.prewarmed:
+                            self.prewarm_hits += 1
+                    joined = True
+                    break
+                if self.scheduler.admit(key, cost, priority, degraded=index > 0):
+                    source = await self._start_source(key, build_command(), renditions, cost, ingest_profile)
+                    self.cold_joins += 1
+                    joined = False
+                    break
+            else:
+                raise self.scheduler.refuse(candidates[-1][3], priority)
+
+            source.add_subscriber(subscriber, rendition if rendition in source.renditions else None)
+            # Opt-in: the ring buffer already replays from the last keyframe, this only saves the wait for it
+            if joined and getattr(settings, 'STREAM_KEYFRAME_ON_JOIN', False):
+                source.request_keyframe()
+        return source
+
+    async def prewarm(self, rtsp_url, profile, size=None, ingest_profile=INGEST_DEFAULT):
+        """Start and pin the ingest for a camera so its first viewer joins a running source
+
+        Prewarming never uses the reserved share of the CPU budget; returns whether the
+        source is running.
+        """
+        key = (rtsp_url, profile)
+        async with self.lock:
+            source = self.sources.get(key)
+            if source is None:
+                cost = self.scheduler.estimate(profile, size)
+                if not self.scheduler.admit(key, cost):
+                    logger.info(f"Not prewarming {redact_url(rtsp_url)} ({profile}): CPU budget is full")
+                    return False
+                source = await self._start_source(
+                    key, build_ffmpeg_command(rtsp_url, profile, ingest_profile), profile_renditions(profile), cost,
+                    ingest_profile,
+                )
+                source.prewarmed = True
+            elif source.teardown_handle:
+                source.teardown_handle.cancel()
+                source.teardown_handle = None
+            source.pinned = True
+        return True
+
+    async def unpin(self, key):
+        """Let a prewarmed source go idle like any other once it has no viewers"""
+        async with self.lock:
+            source = self.sources.get(key)
+            if source is None or not source.pinned:
+                return
+            source.pinned = False
+            if not source.subscribers:
+                self._schedule_teardown(source, self.grace_period)
+
+    async def _start_source(self, key, command, renditions, cost, ingest_profile=None):
+        source = StreamSource(self, key, command, renditions, ingest_profile)
+        source.cost = cost
+        try:
+            await source.start()
+        except Exception:
+            self.scheduler.release(key)
+            raise
+        self.sources[key] = source
+        logger.info(f"Started shared ingest for {redact_url(key[0])} ({key[1]}, {cost:.2f} cores)")
+        return source
+
+    async def unsubscribe(self, source, subscriber, grace_period=None):
+        async with self.lock:
+            source.remove_subscriber(subscriber)
+            if source.subscribers or source.pinned or self.sources.get(source.key) is not source:
+                return
+            # Keep the camera warm for a while in case a viewer comes straight back
+            self._schedule_teardown(source, self.grace_period if grace_period is None else grace_period)
+
+    def _schedule_teardown(self, source, delay):
+        if source.teardown_handle:
+            source.teardown_handle.cancel()
+        loop = asyncio.get_running_loop()
+        source.teardown_handle = loop.call_later(delay, lambda: asyncio.create_task(self._teardown(source)))
+
+    def running_urls(self):
+        """URLs of cameras with a running ingest of their own, proof enough that they are up"""
+        return {
+            key[0] for key, source in tuple(self.sources.items())
+            if source.running and not key[1].startswith('mosaic-')
+        }
+
+    def stats(self):
+        sources = [source.stats() for source in tuple(self.sources.values())]
+        joins = self.warm_joins + self.cold_joins
+        pinned = [source for source in tuple(self.sources.values()) if source.pinned]
+        return {
+            'sources': sources,
+            'cpu_saved_cores': round(sum(source.get('cpu_saved_cores', 0) for source in sources), 2),
+            'scheduler': self.scheduler.stats(),
+            'warm_joins': self.warm_joins,
+            'cold_joins': self.cold_joins,
+            'warm_join_rate': round(self.warm_joins / joins, 3) if joins else None,
+            'prewarm': {
+                'sources': len(pinned),
+                'idle_sources': sum(1 for source in pinned if not source.subscribers),
+                'hits': self.prewarm_hits,
+                'hit_rate': round(self.prewarm_hits / joins, 3) if joins else None,
+                'estimated_cores': round(sum(source.cost for source in pinned), 2),
+                'cpu_percent': round(sum(source.ingest.cpu_percent() or 0 for source in pinned), 1),
+            },
+        }
+
+    async def _teardown(self, source):
+        async with self.lock:
+            if source.subscribers or source.pinned or self.sources.get(source.key) is not source:
+                return
+            del self.sources[source.key]
+            self.scheduler.release(source.key)
+        logger.info(f"Stopping idle ingest for {redact_url(source.key[0])} ({source.key[1]})")
+        await source.stop()
+
+    def _startup_measured(self, source):
+        # Mosaics mix several cameras and are not attributed to any of them
+        if source.ingest_profile is not None:
+            asyncio.create_task(record_startup(source.key[0], source.ingest_profile, source.startup))
+
+    def _source_ended(self, source):
+        if self.sources.get(source.key) is source:
+            del self.sources[source.key]
+            self.scheduler.release(source.key)
+            asyncio.create_task(source.stop())
+
+
+hub = StreamHub()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import time
+from .telemetry import ProgressParser
+
+logger = logging.getLogger(__name__)
+
+
+def output_target(index):
+    """Placeholder for an extra FFmpeg output, replaced by pipe:<fd> when the process starts"""
+    return f'{{output{index}}}'
+
+
+class FFmpegIngest:
+    """Runs FFmpeg as an asyncio subprocess so pipe reads never block the event loop
+
+    Output 0 is stdout. Commands that write several outputs name the others with
+    output_target(1), output_target(2), ...; each gets its own pipe and reader.
+    Commands run with -progress pipe:2 have their reports parsed off stderr and
+    passed to on_progress(ingest, report).
+    """
+
+    def __init__(self, command, read_size=8192, terminate_timeout=5, on_progress=None):
+        self.command = command
+        self.on_progress = on_progress
+        self.progress = ProgressParser()
+        self.read_size = read_size
+        self.terminate_timeout = terminate_timeout
+        self.process = None
+        self.readers = []
+        self.transports = []
+        self.stderr_task = None
+        self.started_at = None
+        self.pid_label = None
+        # Startup milestones of the current process, on the time.monotonic() clock
+        self.input_opened_at = None
+        self.first_byte_at = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        command = list(self.command)
+        pipes = []
+        index = 1
+        while output_target(index) in command:
+            read_fd, write_fd = os.pipe()
+            pipes.append((read_fd, write_fd))
+            command[command.index(output_target(index))] = f'pipe:{write_fd}'
+            index += 1
+
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                pass_fds=[write_fd for _, write_fd in pipes],
+            )
+        except Exception:
+            for read_fd, write_fd in pipes:
+                os.close(read_fd)
+                os.close(write_fd)
+            raise
+
+        loop = asyncio.get_running_loop()
+        self.readers = [self.process.stdout]
+        for read_fd, write_fd in pipes:
+            os.close(write_fd)
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, 'rb', 0)
+            )
+            self.readers.append(reader)
+            self.transports.append(transport)
+
+        self.started_at = time.monotonic()
+        self.input_opened_at = None
+        self.first_byte_at = None
+        self.progress = ProgressParser()
+        self.pid_label = self.process.pid
+        # FFmpeg stalls once its stderr pipe fills up, so it has to be drained
+        self.stderr_task = asyncio.create_task(self._drain_stderr())
+        logger.info(f"Started FFmpeg (pid {self.process.pid})")
+
+    def cpu_seconds(self):
+        """CPU time FFmpeg has used so far, or None where /proc is not available"""
+        if not self.running:
+            return None
+        try:
+            with open(f'/proc/{self.process.pid}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def cpu_percent(self):
+        """Average CPU use since start, 100 meaning one full core"""
+        cpu_seconds = self.cpu_seconds()
+        if cpu_seconds is None:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return cpu_seconds / elapsed * 100 if elapsed > 0 else None
+
+    async def read(self, output=0):
+        """Return the next chunk of an output, or b'' once FFmpeg has exited"""
+        if not self.process:
+            return b''
+        chunk = await self.readers[output].read(self.read_size)
+        if chunk and self.first_byte_at is None:
+            self.first_byte_at = time.monotonic()
+        return chunk
+
+    async def _drain_stderr(self):
+        try:
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                self.handle_stderr_line(line.decode('utf-8', 'replace').rstrip())
+        except asyncio.CancelledError:
+            pass
+
+    def handle_stderr_line(self, line):
+        if self.progress.feed(line):
+            report = self.progress.report()
+            if report and self.on_progress:
+                self.on_progress(self, report)
+            return
+        # Printed once the input is connected and probed
+        if self.input_opened_at is None and line.startswith('Input #'):
+            self.input_opened_at = time.monotonic()
+        logger.debug(f"ffmpeg[{self.pid_label}]: {line}")
+
+    async def stop(self):
+        process = self.process
+        if not process:
+            return
+        self.process = None
+
+        try:
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), timeout=self.terminate_timeout)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            logger.error(f"Error stopping FFmpeg process: {str(e)}")
+
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        self.readers = []
+
+        if self.stderr_task:
+            self.stderr_task.cancel()
+            try:
+                await self.stderr_task
+            except asyncio.CancelledError:
+                pass
+            self.stderr_task = None
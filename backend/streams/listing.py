@@ -0,0 +1,74 @@
+"""Keyset pagination and filters for the stream lists
+
+Shared by both Django apps; backend/streams/listing.py and api/_listing.py are
+kept identical apart from the name of the probe module codec_spellings comes from,
+which scripts/check_shared_modules.py checks.
+"""
+import re
+from django.db.models import Q
+from django.db.models.functions import Lower
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.pagination import CursorPagination
+from .models import MetadataText
+from .rtsp import codec_spellings
+
+# Words of search queries, as the serverless store splits them
+TOKEN = re.compile(r'[a-z0-9]+')
+
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+class StreamCursorPagination(CursorPagination):
+    """Keyset pages of streams, newest id first, for clients that ask with ?limit= or ?cursor=
+
+    The cursor holds the last id seen, so streams created between requests never
+    shift or repeat a page. Requests with neither parameter get the whole list, as
+    they always have.
+    """
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class StreamFilterBackend(BaseFilterBackend):
+    """?category=, ?is_active=, ?codec=, ?resolution= and ?q= on the stream lists
+
+    The first four are equalities on indexed columns or expressions, see
+    Stream.Meta.indexes, so the database narrows the rows without a scan. Every
+    word of q must appear in the name, location or category; substring matches
+    cannot use an index, so they only run over the rows the other filters leave.
+    Detail routes are left alone: get_object() runs the filters too, and their own
+    parameters, like history's ?resolution=, would otherwise turn into a 404.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'detail', False):
+            return queryset
+        params = request.query_params
+        if params.get('category'):
+            queryset = queryset.filter(category=params['category'])
+        if params.get('is_active'):
+            value = params['is_active'].lower()
+            if value not in BOOLEANS:
+                raise ValidationError({'is_active': 'Must be true or false'})
+            queryset = queryset.filter(is_active=BOOLEANS[value])
+        if params.get('codec'):
+            queryset = queryset.alias(metadata_codec=Lower(MetadataText('codec'))).filter(
+                metadata_codec__in=codec_spellings(params['codec'])
+            )
+        if params.get('resolution'):
+            queryset = queryset.alias(metadata_resolution=Lower(MetadataText('resolution'))).filter(
+                metadata_resolution=params['resolution'].lower()
+            )
+        for word in TOKEN.findall(params.get('q', '').lower()):
+            queryset = queryset.filter(
+                Q(name__icontains=word) | Q(metadata__location__icontains=word) | Q(category__icontains=word)
+            )
+        return queryset
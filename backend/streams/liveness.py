@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import random
+import time
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from .hub import hub, redact_url
+from .models import Stream
+from .probe import probe_batch
+from .rtsp import is_rtsp_url
+
+logger = logging.getLogger(__name__)
+
+# Channel layer group that receives is_active transitions, see StatusConsumer
+STATUS_GROUP = 'stream-status'
+
+
+class Health:
+    """Probe schedule and recent history of one stream"""
+
+    __slots__ = ('url', 'is_active', 'alive', 'due', 'interval', 'stable', 'failures', 'last_error')
+
+    def __init__(self, url, is_active, due, interval):
+        self.url = url
+        self.is_active = is_active
+        # Outcome of the last probe, taken to agree with is_active until there is one
+        self.alive = is_active
+        self.due = due
+        self.interval = interval
+        # Consecutive probes that agreed with the one before, and consecutive failures
+        self.stable = 0
+        self.failures = 0
+        self.last_error = None
+
+
+@database_sync_to_async
+def load_streams():
+    return list(Stream.objects.values_list('pk', 'url', 'is_active'))
+
+
+@database_sync_to_async
+def save_transitions(transitions, batch_size):
+    """Write is_active for changed streams only, one UPDATE per batch of ids and value"""
+    now = timezone.now()
+    for is_active in (True, False):
+        ids = [pk for pk, value in transitions.items() if value == is_active]
+        for start in range(0, len(ids), batch_size):
+            # The is_active filter leaves rows alone that someone changed since the sweep read them
+            Stream.objects.filter(pk__in=ids[start:start + batch_size], is_active=not is_active).update(
+                is_active=is_active, updated_at=now
+            )
+
+
+class LivenessSweeper:
+    """Probes every registered stream in the background and keeps is_active in step
+
+    Each stream has its own interval: it starts at min_interval and doubles for every
+    probe that agrees with the previous one, up to max_interval, so flapping cameras
+    are watched closely and steady ones cost little. Due times are jittered and each
+    sweep probes at most max_per_sweep streams with bounded concurrency, so thousands
+    of cameras are spread out rather than probed in one burst. A stream goes inactive
+    after failures consecutive failed probes and active again on the first success.
+    Cameras the hub is already ingesting count as up without a probe.
+    """
+
+    def __init__(self, hub, min_interval=None, max_interval=None, tick=None):
+        self.hub = hub
+        self.min_interval = min_interval or getattr(settings, 'STREAM_LIVENESS_MIN_INTERVAL', 30)
+        self.max_interval = max_interval or getattr(settings, 'STREAM_LIVENESS_MAX_INTERVAL', 600)
+        self.tick = tick if tick is not None else getattr(settings, 'STREAM_LIVENESS_TICK', 5)
+        self.jitter = getattr(settings, 'STREAM_LIVENESS_JITTER', 0.2)
+        self.failures = getattr(settings, 'STREAM_LIVENESS_FAILURES', 2)
+        self.max_per_sweep = getattr(settings, 'STREAM_LIVENESS_MAX_PER_SWEEP', 500)
+        self.batch_size = getattr(settings, 'STREAM_LIVENESS_BATCH_SIZE', 500)
+        self.task = None
+        self.health = {}
+        self.sweeps = 0
+        self.probes = 0
+        self.transitions = 0
+
+    def ensure_started(self):
+        """Start sweeping in the background unless it is disabled or already running"""
+        if self.tick <= 0 or (self.task and not self.task.done()):
+            return
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping stream liveness: {str(e)}")
+            await asyncio.sleep(self.tick)
+
+    def schedule(self, health, now):
+        interval = min(self.max_interval, self.min_interval * 2 ** min(health.stable, 16))
+        health.interval = interval
+        health.due = now + interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def sweep(self, everything=False):
+        """Probe the streams that are due (or all of them) and return the transitions made"""
+        now = time.monotonic()
+        rows = await load_streams()
+        known = {}
+        for pk, url, is_active in rows:
+            health = self.health.get(pk)
+            if health is None or health.url != url:
+                # Spread the first probes of newly seen streams over one minimum interval
+                health = Health(url, is_active, now + random.uniform(0, self.min_interval), self.min_interval)
+            health.is_active = is_active
+            known[pk] = health
+        self.health = known
+
+        due = sorted(
+            (pk for pk, health in known.items() if everything or health.due <= now),
+            key=lambda pk: known[pk].due,
+        )
+        if not everything:
+            due = due[:self.max_per_sweep]
+
+        running = self.hub.running_urls()
+        observed = {}
+        to_probe = []
+        for pk in due:
+            url = known[pk].url
+            if url in running:
+                observed[pk] = (True, None)
+            elif not is_rtsp_url(url):
+                observed[pk] = (False, 'Invalid RTSP URL format')
+            else:
+                to_probe.append(pk)
+
+        if to_probe:
+            results = probe_batch(
+                [known[pk].url for pk in to_probe],
+                concurrency=getattr(settings, 'STREAM_LIVENESS_CONCURRENCY', 32),
+                per_host=getattr(settings, 'STREAM_LIVENESS_PER_HOST', 2),
+                refresh=True,
+            )
+            async for index, result in results:
+                observed[to_probe[index]] = (result['valid'], result['error'])
+            self.probes += len(to_probe)
+
+        now = time.monotonic()
+        transitions = {}
+        for pk, (alive, error) in observed.items():
+            health = known[pk]
+            health.failures = 0 if alive else health.failures + 1
+            health.stable = health.stable + 1 if alive == health.alive else 0
+            health.alive = alive
+            health.last_error = error
+            self.schedule(health, now)
+
+            if alive and not health.is_active:
+                transitions[pk] = True
+            elif not alive and health.is_active and health.failures >= self.failures:
+                transitions[pk] = False
+
+        if transitions:
+            await save_transitions(transitions, self.batch_size)
+            for pk, is_active in transitions.items():
+                health = known[pk]
+                health.is_active = is_active
+                if is_active:
+                    logger.info(f"Stream {pk} ({redact_url(health.url)}) is active again")
+                else:
+                    logger.warning(f"Stream {pk} ({redact_url(health.url)}) is inactive: {health.last_error}")
+            await self.publish(transitions)
+            self.transitions += len(transitions)
+        self.sweeps += 1
+        return transitions
+
+    async def publish(self, transitions):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            await channel_layer.group_send(STATUS_GROUP, {
+                'type': 'stream.status',
+                'transitions': [
+                    {
+                        'stream_id': pk,
+                        'is_active': is_active,
+                        'error': None if is_active else self.health[pk].last_error,
+                    }
+                    for pk, is_active in transitions.items()
+                ],
+            })
+        except Exception as e:
+            logger.warning(f"Could not publish stream status changes: {str(e)}")
+
+    def stats(self):
+        intervals = [health.interval for health in self.health.values()]
+        return {
+            'streams': len(self.health),
+            'sweeps': self.sweeps,
+            'probes': self.probes,
+            'transitions': self.transitions,
+            'failing': sum(1 for health in self.health.values() if health.failures),
+            'mean_interval': round(sum(intervals) / len(intervals), 1) if intervals else None,
+        }
+
+
+sweeper = LivenessSweeper(hub)
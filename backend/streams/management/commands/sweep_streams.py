@@ -0,0 +1,30 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from streams.liveness import sweeper
+
+
+class Command(BaseCommand):
+    help = "Probe registered streams and keep is_active up to date, outside the ASGI server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Probe every stream once and exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            # A single pass has no later probe to confirm a failure with
+            sweeper.failures = 1
+            transitions = asyncio.run(sweeper.sweep(everything=True))
+            for pk, is_active in transitions.items():
+                self.stdout.write(f"Stream {pk}: {'active' if is_active else 'inactive'}")
+            self.stdout.write(self.style.SUCCESS(f"Probed {sweeper.probes} streams, {len(transitions)} changed"))
+            return
+
+        asyncio.run(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                await sweeper.sweep()
+            except Exception as e:
+                self.stderr.write(f"Error sweeping stream liveness: {str(e)}")
+            await asyncio.sleep(sweeper.tick or 5)
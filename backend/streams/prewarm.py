@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .hub import hub, redact_url
+from .liveness import sweeper
+from .models import Stream
+from .probe import resolve_profile
+from .scheduler import stream_size
+from .startup import stream_ingest_profile
+
+logger = logging.getLogger(__name__)
+
+
+def parse_hours(value):
+    """Hours of the day from [7, 8, 9], '7-19' or '6-9,17-20'; ranges include both ends"""
+    if isinstance(value, (list, tuple)):
+        return {int(hour) % 24 for hour in value}
+    hours = set()
+    for part in str(value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        start = int(start)
+        end = int(end) if end else start
+        hour = start
+        while True:
+            hours.add(hour % 24)
+            if hour % 24 == end % 24:
+                break
+            hour += 1
+    return hours
+
+
+def wants_prewarm(stream, hour):
+    """Favorites when STREAM_PREWARM_FAVORITES is on, and streams whose prewarm_hours include hour"""
+    if stream.is_favorite and getattr(settings, 'STREAM_PREWARM_FAVORITES', True):
+        return True
+    hours = stream.get_metadata().get('prewarm_hours')
+    if hours is None:
+        return False
+    try:
+        return hour in parse_hours(hours)
+    except ValueError:
+        logger.warning(f"Ignoring invalid prewarm_hours for stream {stream.pk}: {hours!r}")
+        return False
+
+
+@database_sync_to_async
+def get_prewarm_streams(hour):
+    streams = Stream.objects.filter(is_active=True).filter(
+        Q(is_favorite=True) | Q(metadata__has_key='prewarm_hours')
+    )
+    limit = getattr(settings, 'STREAM_PREWARM_MAX', 8)
+    return [stream for stream in streams if wants_prewarm(stream, hour)][:limit]
+
+
+class Prewarmer:
+    """Keeps the ingests of selected cameras running so their first viewer gets video at once
+
+    Every interval the wanted cameras are pinned in the hub and cameras that dropped out
+    of the set are unpinned, after which they go idle like any other source.
+    """
+
+    def __init__(self, hub, interval=None):
+        self.hub = hub
+        self.interval = interval
+        self.task = None
+        self.pinned = set()
+
+    def ensure_started(self):
+        """Start refreshing in the background unless it is disabled or already running"""
+        interval = self.interval or getattr(settings, 'STREAM_PREWARM_INTERVAL', 60)
+        if interval <= 0 or (self.task and not self.task.done()):
+            return
+        self.task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for key in self.pinned:
+            await self.hub.unpin(key)
+        self.pinned = set()
+
+    async def _run(self, interval):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error prewarming streams: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def refresh(self):
+        streams = await get_prewarm_streams(timezone.localtime().hour)
+        wanted = set()
+        for stream in streams:
+            profile = await resolve_profile(stream, stream.url)
+            key = (stream.url, profile)
+            if await self.hub.prewarm(stream.url, profile, stream_size(stream), stream_ingest_profile(stream)):
+                wanted.add(key)
+                if key not in self.pinned:
+                    logger.info(f"Prewarmed {redact_url(stream.url)} ({profile})")
+
+        for key in self.pinned - wanted:
+            await self.hub.unpin(key)
+        self.pinned = wanted
+
+
+prewarmer = Prewarmer(hub)
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan handler that starts prewarming and liveness sweeps with the server rather than the first socket"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            prewarmer.ensure_started()
+            sweeper.ensure_started()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await sweeper.stop()
+            await prewarmer.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .profiles import normalize_codec, select_profile
+from .rtsp import ProbeCache, cached_probe, probe_many
+
+logger = logging.getLogger(__name__)
+
+probe_cache = ProbeCache(
+    ttl=getattr(settings, 'STREAM_PROBE_CACHE_TTL', 300),
+    negative_ttl=getattr(settings, 'STREAM_PROBE_NEGATIVE_TTL', 15),
+)
+
+
+async def probe_stream(rtsp_url, timeout=None):
+    """Describe a stream over RTSP (codec, profile, resolution, fps), cached per URL"""
+    if timeout is None:
+        timeout = getattr(settings, 'STREAM_PROBE_TIMEOUT', 5)
+    return await cached_probe(rtsp_url, probe_cache, timeout)
+
+
+def probe_batch(rtsp_urls, timeout=None, concurrency=None, per_host=None, refresh=False):
+    """probe_stream() for many URLs at once, as an async iterator of (index, result)"""
+    if timeout is None:
+        timeout = getattr(settings, 'STREAM_PROBE_TIMEOUT', 5)
+    return probe_many(
+        rtsp_urls,
+        probe_cache,
+        timeout,
+        concurrency=concurrency or getattr(settings, 'STREAM_BATCH_CONCURRENCY', 64),
+        per_host=per_host or getattr(settings, 'STREAM_BATCH_PER_HOST', 4),
+        refresh=refresh,
+    )
+
+
+async def probe_codec(rtsp_url, timeout=None):
+    """Codec of the first video stream from the SDP, falling back to ffprobe, or None"""
+    if timeout is None:
+        timeout = getattr(settings, 'STREAM_PROBE_TIMEOUT', 5)
+    result = await probe_stream(rtsp_url, timeout)
+    if result['codec']:
+        return result['codec']
+    if not result['reachable']:
+        return None
+    return await ffprobe_codec(rtsp_url, timeout)
+
+
+async def ffprobe_codec(rtsp_url, timeout):
+    """Ask ffprobe for the codec of the first video stream, or None if it cannot tell"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            settings.FFPROBE_PATH,
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=codec_name',
+            '-of', 'csv=p=0',
+            rtsp_url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except OSError as e:
+        logger.error(f"Could not run ffprobe: {str(e)}")
+        return None
+
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return None
+    return stdout.decode('utf-8', 'replace').strip() or None
+
+
+async def resolve_profile(stream, rtsp_url):
+    """Remux when the camera already sends H.264, transcode otherwise"""
+    codec = stream.get_metadata().get('codec') if stream else None
+    if not codec:
+        codec = await probe_codec(rtsp_url)
+        if codec and stream:
+            await database_sync_to_async(stream.set_metadata)('codec', normalize_codec(codec))
+    return select_profile(codec)
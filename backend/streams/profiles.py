@@ -0,0 +1,243 @@
+import re
+from django.conf import settings
+from .ingest import output_target
+from .rtsp import normalize_codec
+
+PROFILE_TRANSCODE = 'transcode'
+PROFILE_PASSTHROUGH = 'passthrough'
+PROFILE_LADDER = 'ladder'
+PROFILES = (PROFILE_TRANSCODE, PROFILE_PASSTHROUGH, PROFILE_LADDER)
+DEFAULT_PROFILE = PROFILE_TRANSCODE
+
+# Input options per ingest profile, chosen per camera through Stream.metadata['ingest_profile'].
+# FFmpeg's defaults probe up to 5 MB / 5 s of input and try UDP before falling back to TCP.
+INGEST_DEFAULT = 'default'
+INGEST_PROFILES = {
+    INGEST_DEFAULT: [],
+    'low-latency': [
+        '-rtsp_transport', 'tcp',
+        '-probesize', '32768',
+        '-analyzeduration', '500000',
+        '-fflags', 'nobuffer',
+        '-flags', 'low_delay',
+    ],
+    'robust-tcp': [
+        '-rtsp_transport', 'tcp',
+        '-timeout', '10000000',
+        '-fflags', '+genpts',
+    ],
+    'lossy-udp': [
+        '-rtsp_transport', 'udp',
+        '-buffer_size', '1048576',
+        '-reorder_queue_size', '64',
+        '-max_delay', '500000',
+        '-probesize', '32768',
+        '-analyzeduration', '500000',
+        '-fflags', 'nobuffer+discardcorrupt',
+    ],
+}
+
+# Single-output profiles publish one rendition; the ladder publishes one per entry
+RENDITION_SOURCE = 'source'
+RENDITIONS = {
+    '1080p': {'height': 1080, 'bitrate': '4500k'},
+    '720p': {'height': 720, 'bitrate': '2500k'},
+    '360p': {'height': 360, 'bitrate': '800k'},
+}
+LADDER_RENDITIONS = ('1080p', '720p', '360p')
+RENDITION_AUTO = 'auto'
+
+# Cheaper profile to fall back to when the CPU budget cannot take the requested one
+DEGRADED_PROFILES = {PROFILE_LADDER: PROFILE_TRANSCODE}
+
+# Stream.quality values mapped onto a starting rendition
+QUALITY_RENDITIONS = {'high': '1080p', 'medium': '720p', 'low': '360p'}
+
+# Seconds between forced keyframes of every libx264 encode. Ladder renditions share the
+# grid so switches line up, and with STREAM_FRAGMENT_DURATION it bounds how many fragments
+# a late joiner replays from the last keyframe, which must stay under the client queue limit
+KEYFRAME_INTERVAL = 2
+
+# Rough libx264 ultrafast throughput of one core, used to estimate transcode cost
+TRANSCODE_PIXELS_PER_CORE = 60_000_000
+PASSTHROUGH_CORES = 0.02
+
+
+def profile_renditions(profile):
+    return LADDER_RENDITIONS if profile == PROFILE_LADDER else (RENDITION_SOURCE,)
+
+
+def select_profile(codec):
+    """Remux browser-compatible sources, transcode everything else (including unknown)"""
+    if normalize_codec(codec) == 'h264':
+        return PROFILE_PASSTHROUGH
+    return PROFILE_TRANSCODE
+
+
+def parse_resolution(resolution):
+    match = re.match(r'^\s*(\d+)\s*x\s*(\d+)\s*$', str(resolution or ''))
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def estimate_cpu_cores(profile, width=1920, height=1080, fps=30):
+    """Estimated cores an ingest of this size needs under the given profile"""
+    if profile == PROFILE_PASSTHROUGH:
+        return PASSTHROUGH_CORES
+    if profile == PROFILE_LADDER:
+        # One decode at source size plus one encode per rendition
+        pixels = width * height + sum(
+            RENDITIONS[name]['height'] ** 2 * 16 / 9 for name in LADDER_RENDITIONS
+        )
+        return PASSTHROUGH_CORES + pixels * fps / TRANSCODE_PIXELS_PER_CORE
+    return PASSTHROUGH_CORES + width * height * fps / TRANSCODE_PIXELS_PER_CORE
+
+
+def ingest_options(ingest_profile):
+    if ingest_profile not in INGEST_PROFILES:
+        raise ValueError(f"Unknown ingest profile: {ingest_profile}")
+    return INGEST_PROFILES[ingest_profile]
+
+
+def fragment_options():
+    """Cut transcoded fragments every STREAM_FRAGMENT_DURATION seconds as well as at keyframes
+
+    Shorter fragments reach viewers sooner after a keyframe, which is what bounds join
+    latency. Only use them with keyframe_options(): an unpinned GOP of ~250 frames
+    would be more fragments than a viewer's queue holds.
+    """
+    duration = getattr(settings, 'STREAM_FRAGMENT_DURATION', 0)
+    if not duration:
+        return []
+    return ['-frag_duration', str(int(duration * 1_000_000))]
+
+
+def keyframe_options():
+    return ['-force_key_frames', f'expr:gte(t,n_forced*{KEYFRAME_INTERVAL})']
+
+
+def progress_options():
+    """Have FFmpeg report progress on stderr every STREAM_PROGRESS_PERIOD seconds, see telemetry"""
+    period = getattr(settings, 'STREAM_PROGRESS_PERIOD', 1)
+    if not period:
+        return []
+    return ['-nostats', '-progress', 'pipe:2', '-stats_period', str(period)]
+
+
+def build_ladder_command(rtsp_url, ingest_profile=INGEST_DEFAULT):
+    """One decode split into a scaled libx264 encode per rendition, each on its own pipe"""
+    count = len(LADDER_RENDITIONS)
+    graph = f"[0:v]split={count}" + ''.join(f"[s{i}]" for i in range(count))
+    for i, name in enumerate(LADDER_RENDITIONS):
+        graph += f";[s{i}]scale=-2:{RENDITIONS[name]['height']}[v{i}]"
+
+    command = [
+        settings.FFMPEG_PATH, *progress_options(), *ingest_options(ingest_profile),
+        '-i', rtsp_url, '-filter_complex', graph,
+    ]
+    for i, name in enumerate(LADDER_RENDITIONS):
+        bitrate = RENDITIONS[name]['bitrate']
+        command += [
+            '-map', f'[v{i}]',
+            '-map', '0:a?',
+            '-c:v', 'libx264',
+            '-preset', 'ultrafast',
+            '-tune', 'zerolatency',
+            '-b:v', bitrate,
+            '-maxrate', bitrate,
+            '-bufsize', bitrate,
+            *keyframe_options(),
+            '-c:a', 'aac',
+            '-f', 'mp4',
+            '-movflags', 'frag_keyframe+empty_moov',
+            *fragment_options(),
+            '-' if i == 0 else output_target(i),
+        ]
+    return command
+
+
+def parse_layout(layout, count):
+    """'4x4' -> (4, 4); 'auto' picks the smallest near-square grid that fits count tiles"""
+    if layout in (None, '', 'auto'):
+        columns = 1
+        while columns * columns < count:
+            columns += 1
+        rows = -(-count // columns)
+        return columns, rows
+    match = re.match(r'^(\d+)x(\d+)$', str(layout))
+    if not match:
+        raise ValueError(f"Invalid mosaic layout: {layout}")
+    columns, rows = int(match.group(1)), int(match.group(2))
+    if columns < 1 or rows < 1 or columns * rows < count:
+        raise ValueError(f"Layout {layout} cannot hold {count} streams")
+    return columns, rows
+
+
+def build_mosaic_command(rtsp_urls, columns, rows):
+    """Compose several cameras into one grid with a single filter_complex and encode"""
+    width = getattr(settings, 'MOSAIC_WIDTH', 1920)
+    height = getattr(settings, 'MOSAIC_HEIGHT', 1080)
+    fps = getattr(settings, 'MOSAIC_FPS', 15)
+    # libx264 needs even dimensions
+    tile_width = width // columns // 2 * 2
+    tile_height = height // rows // 2 * 2
+
+    command = [settings.FFMPEG_PATH, *progress_options()]
+    for rtsp_url in rtsp_urls:
+        command += ['-i', rtsp_url]
+
+    filters = []
+    positions = []
+    for index in range(len(rtsp_urls)):
+        filters.append(
+            f"[{index}:v]scale={tile_width}:{tile_height}:force_original_aspect_ratio=decrease,"
+            f"pad={tile_width}:{tile_height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps}[t{index}]"
+        )
+        positions.append(f"{index % columns * tile_width}_{index // columns * tile_height}")
+    inputs = ''.join(f"[t{index}]" for index in range(len(rtsp_urls)))
+    grid_width, grid_height = tile_width * columns, tile_height * rows
+    if len(rtsp_urls) == 1:
+        filters.append(f"[t0]pad={grid_width}:{grid_height}:0:0[out]")
+    else:
+        filters.append(
+            f"{inputs}xstack=inputs={len(rtsp_urls)}:layout={'|'.join(positions)}:fill=black,"
+            f"pad={grid_width}:{grid_height}:0:0[out]"
+        )
+
+    return command + [
+        '-filter_complex', ';'.join(filters),
+        '-map', '[out]',
+        '-c:v', 'libx264',
+        '-preset', 'ultrafast',
+        '-tune', 'zerolatency',
+        '-an',
+        '-f', 'mp4',
+        '-movflags', 'frag_keyframe+empty_moov',
+        '-'
+    ]
+
+
+def build_ffmpeg_command(rtsp_url, profile=DEFAULT_PROFILE, ingest_profile=INGEST_DEFAULT):
+    """FFmpeg command line that turns an RTSP source into fragmented MP4 on stdout"""
+    if profile == PROFILE_LADDER:
+        return build_ladder_command(rtsp_url, ingest_profile)
+    if profile == PROFILE_TRANSCODE:
+        video = ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', *keyframe_options()]
+    elif profile == PROFILE_PASSTHROUGH:
+        video = ['-c:v', 'copy']
+    else:
+        raise ValueError(f"Unknown stream profile: {profile}")
+
+    return [
+        settings.FFMPEG_PATH,
+        *progress_options(),
+        *ingest_options(ingest_profile),
+        '-i', rtsp_url,
+        *video,
+        '-c:a', 'aac',
+        '-f', 'mp4',
+        '-movflags', 'frag_keyframe+empty_moov',
+        *(fragment_options() if profile == PROFILE_TRANSCODE else []),
+        '-'
+    ]
@@ -3,4 +3,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/stream/(?P<stream_id>\w+)/$', consumers.StreamConsumer.as_asgi()),
+    re_path(r'ws/mosaic/$', consumers.MosaicConsumer.as_asgi()),
+    re_path(r'ws/streams/$', consumers.MultiplexConsumer.as_asgi()),
+    re_path(r'ws/status/$', consumers.StatusConsumer.as_asgi()),
 ]
@@ -0,0 +1,543 @@
+"""Minimal asyncio RTSP client: OPTIONS and DESCRIBE, SDP and SPS parsing, a TTL result cache
+
+Only the standard library is used so the serverless API can ship the same file;
+backend/streams/rtsp.py and api/_rtsp_probe.py are kept identical, which
+scripts/check_shared_modules.py checks.
+"""
+import asyncio
+import base64
+import hashlib
+import re
+import time
+import urllib.parse
+
+USER_AGENT = 'rtsp-viewer-probe/1.0'
+# RTSP over TLS (rtsps://) has its own well-known port
+DEFAULT_PORTS = {'rtsp': 554, 'rtsps': 322}
+
+H264_PROFILES = {
+    66: 'Baseline', 77: 'Main', 88: 'Extended', 100: 'High', 110: 'High 10', 122: 'High 4:2:2',
+    244: 'High 4:4:4 Predictive', 44: 'CAVLC 4:4:4 Intra',
+}
+H265_PROFILES = {1: 'Main', 2: 'Main 10', 3: 'Main Still Picture', 4: 'Range Extensions'}
+
+# Profiles whose SPS carries chroma format, bit depth and scaling lists
+H264_HIGH_PROFILES = {100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135}
+
+CODEC_NAMES = {
+    'h264': 'h264', 'h265': 'h265', 'hevc': 'h265', 'jpeg': 'mjpeg', 'mp4v-es': 'mpeg4',
+    'pcma': 'pcm_alaw', 'pcmu': 'pcm_mulaw', 'mpeg4-generic': 'aac', 'mp4a-latm': 'aac', 'opus': 'opus',
+}
+# Static RTP payload types that need no rtpmap line
+STATIC_PAYLOADS = {'0': 'PCMU', '8': 'PCMA', '26': 'JPEG'}
+
+# Other spellings of the video codecs, by the name normalize_codec() gives them
+CODEC_ALIASES = {'h264': ('h264', 'avc', 'avc1'), 'h265': ('h265', 'hevc', 'hev1', 'hvc1')}
+
+
+class RTSPError(Exception):
+    """The server answered, but not with a usable description; status is the RTSP code if any"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class BitReader:
+    """Big-endian bit reader with the Exp-Golomb codes used by H.264 and H.265 parameter sets"""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def u(self, bits):
+        value = 0
+        for _ in range(bits):
+            byte = self.data[self.position >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.position & 7))) & 1)
+            self.position += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("Invalid Exp-Golomb code")
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def unescape_rbsp(nal):
+    """Drop emulation prevention bytes (00 00 03 -> 00 00)"""
+    return re.sub(b'\x00\x00\x03', b'\x00\x00', nal)
+
+
+def parse_h264_sps(nal):
+    """Profile, level, resolution and frame rate from an H.264 sequence parameter set NAL unit"""
+    reader = BitReader(unescape_rbsp(nal[1:]))
+    profile_idc = reader.u(8)
+    reader.u(8)  # constraint flags
+    level_idc = reader.u(8)
+    reader.ue()  # seq_parameter_set_id
+
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    if profile_idc in H264_HIGH_PROFILES:
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = reader.u(1)
+        reader.ue()  # bit_depth_luma_minus8
+        reader.ue()  # bit_depth_chroma_minus8
+        reader.u(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.u(1):  # seq_scaling_matrix_present_flag
+            for index in range(8 if chroma_format_idc != 3 else 12):
+                if reader.u(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if index < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + reader.se() + 256) % 256
+                        last_scale = next_scale or last_scale
+
+    reader.ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.ue()
+    if pic_order_cnt_type == 0:
+        reader.ue()
+    elif pic_order_cnt_type == 1:
+        reader.u(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()  # max_num_ref_frames
+    reader.u(1)  # gaps_in_frame_num_value_allowed_flag
+    width_in_mbs = reader.ue() + 1
+    height_in_map_units = reader.ue() + 1
+    frame_mbs_only = reader.u(1)
+    if not frame_mbs_only:
+        reader.u(1)  # mb_adaptive_frame_field_flag
+    reader.u(1)  # direct_8x8_inference_flag
+
+    width = width_in_mbs * 16
+    height = (2 - frame_mbs_only) * height_in_map_units * 16
+    if reader.u(1):  # frame_cropping_flag
+        left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+        if chroma_format_idc == 0 or separate_colour_plane:
+            crop_x, crop_y = 1, 2 - frame_mbs_only
+        else:
+            crop_x = 1 if chroma_format_idc == 3 else 2
+            crop_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+        width -= crop_x * (left + right)
+        height -= crop_y * (top + bottom)
+
+    fps = None
+    if reader.u(1):  # vui_parameters_present_flag
+        fps = _parse_vui_fps(reader)
+
+    return {
+        'profile': H264_PROFILES.get(profile_idc, str(profile_idc)),
+        'level': f"{level_idc / 10:g}",
+        'width': width,
+        'height': height,
+        'fps': fps,
+    }
+
+
+def _parse_vui_fps(reader):
+    if reader.u(1):  # aspect_ratio_info_present_flag
+        if reader.u(8) == 255:
+            reader.u(32)
+    if reader.u(1):  # overscan_info_present_flag
+        reader.u(1)
+    if reader.u(1):  # video_signal_type_present_flag
+        reader.u(4)
+        if reader.u(1):
+            reader.u(24)
+    if reader.u(1):  # chroma_loc_info_present_flag
+        reader.ue()
+        reader.ue()
+    if reader.u(1):  # timing_info_present_flag
+        num_units_in_tick = reader.u(32)
+        time_scale = reader.u(32)
+        if num_units_in_tick:
+            return round(time_scale / (2 * num_units_in_tick), 3)
+    return None
+
+
+def parse_h265_sps(nal):
+    """Profile, level and resolution from an H.265 sequence parameter set NAL unit"""
+    reader = BitReader(unescape_rbsp(nal[2:]))
+    reader.u(4)  # sps_video_parameter_set_id
+    max_sub_layers_minus1 = reader.u(3)
+    reader.u(1)  # sps_temporal_id_nesting_flag
+
+    reader.u(3)  # general_profile_space, general_tier_flag
+    profile_idc = reader.u(5)
+    reader.u(32)  # general_profile_compatibility_flags
+    reader.u(48)  # source and constraint flags
+    level_idc = reader.u(8)
+    sub_layers = [(reader.u(1), reader.u(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1:
+        reader.u(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in sub_layers:
+        if profile_present:
+            reader.u(88)
+        if level_present:
+            reader.u(8)
+
+    reader.ue()  # sps_seq_parameter_set_id
+    chroma_format_idc = reader.ue()
+    if chroma_format_idc == 3:
+        reader.u(1)
+    width = reader.ue()
+    height = reader.ue()
+    if reader.u(1):  # conformance_window_flag
+        left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+        crop_x = 2 if chroma_format_idc in (1, 2) else 1
+        crop_y = 2 if chroma_format_idc == 1 else 1
+        width -= crop_x * (left + right)
+        height -= crop_y * (top + bottom)
+
+    return {
+        'profile': H265_PROFILES.get(profile_idc, str(profile_idc)),
+        'level': f"{level_idc / 30:g}",
+        'width': width,
+        'height': height,
+        'fps': None,
+    }
+
+
+def parse_sdp(text):
+    """Split an SDP description into its media sections with rtpmap, fmtp and other attributes"""
+    media = []
+    current = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('m='):
+            kind, _, _, *formats = line[2:].split() + [''] * 3
+            current = {'type': kind, 'formats': [f for f in formats if f], 'rtpmap': {}, 'fmtp': {}, 'attributes': {}}
+            media.append(current)
+        elif current is not None and line.startswith('a='):
+            name, _, value = line[2:].partition(':')
+            if name == 'rtpmap':
+                payload, _, encoding = value.partition(' ')
+                current['rtpmap'][payload] = encoding.strip()
+            elif name == 'fmtp':
+                payload, _, params = value.partition(' ')
+                current['fmtp'][payload] = dict(
+                    (key.strip().lower(), val.strip())
+                    for key, _, val in (param.partition('=') for param in params.split(';'))
+                    if key.strip()
+                )
+            else:
+                current['attributes'][name] = value.strip()
+    return media
+
+
+def _media_codec(section):
+    payload = section['formats'][0] if section['formats'] else None
+    encoding = section['rtpmap'].get(payload) or STATIC_PAYLOADS.get(payload, '')
+    name = encoding.split('/')[0].lower()
+    return payload, CODEC_NAMES.get(name, name or None)
+
+
+def is_rtsp_url(url):
+    """Whether url has a scheme RTSPConnection speaks, rtsp:// or rtsps://"""
+    scheme, separator, _ = url.partition('://')
+    return bool(separator) and scheme.lower() in DEFAULT_PORTS
+
+
+def normalize_codec(codec):
+    """'H.264', 'h264', 'AVC1' -> 'h264'; 'H.265', 'hevc' -> 'h265'"""
+    if not codec:
+        return None
+    codec = re.sub(r'[^a-z0-9]', '', str(codec).lower())
+    for name, aliases in CODEC_ALIASES.items():
+        if codec in aliases:
+            return name
+    return codec
+
+
+def codec_spellings(codec):
+    """Lower-case forms a stored codec may take for the same normalize_codec(): hevc also finds H.265"""
+    name = normalize_codec(codec)
+    if name is None:
+        return []
+    spellings = {str(codec).lower()}
+    for alias in CODEC_ALIASES.get(name, (name,)):
+        spellings.add(alias)
+        match = re.fullmatch(r'([a-z]+)(\d+)', alias)
+        if match:
+            spellings.add(f'{match.group(1)}.{match.group(2)}')
+    return sorted(spellings)
+
+
+def empty_media():
+    return {'codec': None, 'profile': None, 'level': None, 'resolution': None, 'fps': None, 'audio_codec': None}
+
+
+def describe_media(sdp):
+    """Codec, profile, level, resolution and frame rate of the first video and audio sections"""
+    info = empty_media()
+    for section in parse_sdp(sdp):
+        payload, codec = _media_codec(section)
+        if section['type'] == 'audio' and info['audio_codec'] is None:
+            info['audio_codec'] = codec
+        if section['type'] != 'video' or info['codec'] is not None:
+            continue
+
+        info['codec'] = codec
+        fmtp = section['fmtp'].get(payload, {})
+        attributes = section['attributes']
+        sps = None
+        try:
+            if codec == 'h264':
+                profile_level_id = fmtp.get('profile-level-id')
+                if profile_level_id and len(profile_level_id) == 6:
+                    profile_idc = int(profile_level_id[:2], 16)
+                    info['profile'] = H264_PROFILES.get(profile_idc, str(profile_idc))
+                    info['level'] = f"{int(profile_level_id[4:], 16) / 10:g}"
+                sets = fmtp.get('sprop-parameter-sets')
+                if sets:
+                    sps = parse_h264_sps(base64.b64decode(sets.split(',')[0] + '=='))
+            elif codec == 'h265' and fmtp.get('sprop-sps'):
+                sps = parse_h265_sps(base64.b64decode(fmtp['sprop-sps'] + '=='))
+        except (ValueError, IndexError, TypeError):
+            sps = None
+
+        if sps:
+            info['profile'] = sps['profile']
+            info['level'] = sps['level']
+            if sps['width'] and sps['height']:
+                info['resolution'] = f"{sps['width']}x{sps['height']}"
+            info['fps'] = sps['fps']
+
+        dimensions = re.match(r'^\s*(\d+)\s*,\s*(\d+)', attributes.get('x-dimensions', ''))
+        if info['resolution'] is None and dimensions:
+            info['resolution'] = f"{dimensions.group(1)}x{dimensions.group(2)}"
+        framerate = attributes.get('framerate') or attributes.get('x-framerate')
+        if framerate:
+            try:
+                info['fps'] = float(framerate)
+            except ValueError:
+                pass
+    return info
+
+
+def redact(url):
+    return re.sub(r'//[^/@]+@', '//***@', url)
+
+
+class RTSPConnection:
+    """One RTSP/1.0 control connection with Basic and Digest authentication"""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+            raise RTSPError("Invalid RTSP URL format")
+        self.host = parts.hostname
+        self.port = parts.port or DEFAULT_PORTS[parts.scheme]
+        self.username = urllib.parse.unquote(parts.username or '')
+        self.password = urllib.parse.unquote(parts.password or '')
+        netloc = self.host if ':' not in self.host else f'[{self.host}]'
+        if parts.port:
+            netloc += f':{parts.port}'
+        self.url = urllib.parse.urlunsplit((parts.scheme, netloc, parts.path or '/', parts.query, ''))
+        self.tls = parts.scheme == 'rtsps'
+        self.cseq = 0
+        self.authorization = None
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.tls or None)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+    async def request(self, method, headers=None):
+        """Send a request, answering one 401 challenge; returns (status, headers, body)"""
+        status, response_headers, body = await self._send(method, headers)
+        if status == 401 and self.username:
+            challenges = response_headers.get('www-authenticate', [])
+            self.authorization = self._authorize(method, challenges)
+            if self.authorization:
+                status, response_headers, body = await self._send(method, headers)
+        return status, response_headers, body
+
+    async def _send(self, method, headers=None):
+        self.cseq += 1
+        lines = [f'{method} {self.url} RTSP/1.0', f'CSeq: {self.cseq}', f'User-Agent: {USER_AGENT}']
+        if self.authorization:
+            lines.append(f'Authorization: {self.authorization(method)}')
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        await self.writer.drain()
+
+        status_line = (await self.reader.readline()).decode('latin-1').strip()
+        match = re.match(r'^RTSP/\d\.\d\s+(\d{3})', status_line)
+        if not match:
+            raise RTSPError(f"Not an RTSP server (got {status_line[:40]!r})")
+        response_headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            response_headers.setdefault(name.strip().lower(), []).append(value.strip())
+        length = int((response_headers.get('content-length') or ['0'])[0])
+        body = await self.reader.readexactly(length) if length else b''
+        return int(match.group(1)), response_headers, body
+
+    def _authorize(self, method, challenges):
+        """Pick Digest over Basic and return a function building the header for a method"""
+        digest = next((c for c in challenges if c.lower().startswith('digest')), None)
+        if digest:
+            params = dict(re.findall(r'(\w+)="?([^",]*)"?', digest[6:]))
+            realm, nonce = params.get('realm', ''), params.get('nonce', '')
+            ha1 = hashlib.md5(f'{self.username}:{realm}:{self.password}'.encode()).hexdigest()
+
+            def header(method):
+                ha2 = hashlib.md5(f'{method}:{self.url}'.encode()).hexdigest()
+                response = hashlib.md5(f'{ha1}:{nonce}:{ha2}'.encode()).hexdigest()
+                return (
+                    f'Digest username="{self.username}", realm="{realm}", nonce="{nonce}", '
+                    f'uri="{self.url}", response="{response}"'
+                )
+            return header
+        if any(c.lower().startswith('basic') for c in challenges):
+            token = base64.b64encode(f'{self.username}:{self.password}'.encode()).decode()
+            return lambda method: f'Basic {token}'
+        return None
+
+
+async def _probe(url):
+    connection = RTSPConnection(url)
+    started = time.monotonic()
+    try:
+        await connection.open()
+        connected = time.monotonic()
+        status, headers, _ = await connection.request('OPTIONS')
+        methods = [m.strip() for m in ','.join(headers.get('public', [])).split(',') if m.strip()]
+        status, headers, body = await connection.request('DESCRIBE', {'Accept': 'application/sdp'})
+        if status == 401:
+            raise RTSPError("Authentication failed", status)
+        if status != 200:
+            raise RTSPError(f"DESCRIBE failed with RTSP {status}", status)
+        return {
+            'server': (headers.get('server') or [None])[0],
+            'methods': methods,
+            'connect_ms': round((connected - started) * 1000, 1),
+            **describe_media(body.decode('utf-8', 'replace')),
+        }
+    finally:
+        connection.close()
+
+
+async def probe(url, timeout=5.0):
+    """Describe an RTSP stream without opening a media session
+
+    Always returns a dict: valid is True when the server described a stream, reachable
+    is True when an RTSP server answered at all, error explains anything else.
+    """
+    started = time.monotonic()
+    result = {'url': redact(url), 'valid': False, 'reachable': False, 'error': None, **empty_media()}
+    try:
+        result.update(await asyncio.wait_for(_probe(url), timeout))
+        result['valid'] = result['reachable'] = True
+    except asyncio.TimeoutError:
+        result['error'] = f"No RTSP response within {timeout:g}s"
+    except RTSPError as e:
+        result['reachable'] = e.status is not None
+        result['error'] = str(e)
+    except (OSError, asyncio.IncompleteReadError, ValueError, UnicodeError) as e:
+        result['error'] = f"Connection failed: {e}"
+    result['probe_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+class ProbeCache:
+    """Probe results per URL; failures are kept for negative_ttl, successes for ttl seconds"""
+
+    def __init__(self, ttl=300, negative_ttl=15, max_entries=4096):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        entry = self.entries.get(url)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, url, result):
+        ttl = self.ttl if result['valid'] else self.negative_ttl
+        if len(self.entries) >= self.max_entries:
+            now = time.monotonic()
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[0] >= now}
+            while len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+        self.entries[url] = (time.monotonic() + ttl, result)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+async def cached_probe(url, cache, timeout=5.0, refresh=False):
+    """probe() through cache; the returned dict says whether it came from the cache
+
+    refresh probes even when a result is cached, and stores the new one.
+    """
+    result = None if refresh else cache.get(url)
+    if result is not None:
+        return {**result, 'cached': True}
+    result = await probe(url, timeout)
+    cache.put(url, result)
+    return {**result, 'cached': False}
+
+
+async def probe_many(urls, cache, timeout=5.0, concurrency=64, per_host=4, refresh=False):
+    """Probe urls concurrently, yielding (index, result) pairs in completion order
+
+    At most concurrency probes run at once and at most per_host against one host, so
+    a site whose cameras sit behind one NVR is not flooded. Repeated URLs are probed
+    once. Closing the generator cancels whatever is still running.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = {}
+    indexes = {}
+    for index, url in enumerate(urls):
+        indexes.setdefault(url, []).append(index)
+
+    async def run(url):
+        host = urllib.parse.urlsplit(url).hostname
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(per_host))
+        # Wait for the host first so queued probes of a busy host do not hold global slots
+        async with host_limit, limit:
+            return url, await cached_probe(url, cache, timeout, refresh)
+
+    tasks = [asyncio.ensure_future(run(url)) for url in indexes]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            url, result = await next_done
+            for index in indexes[url]:
+                yield index, result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
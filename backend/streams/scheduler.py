@@ -0,0 +1,123 @@
+import logging
+from django.conf import settings
+from .profiles import (
+    DEGRADED_PROFILES, PROFILE_TRANSCODE, estimate_cpu_cores, parse_resolution,
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+
+# Assumed source size when a stream has no resolution or fps in its metadata
+DEFAULT_SOURCE_SIZE = (1920, 1080, 30)
+
+
+class AdmissionRefused(Exception):
+    """Raised when a new ingest does not fit in the CPU budget, even degraded"""
+
+    def __init__(self, message, required_cores, available_cores):
+        super().__init__(message)
+        self.required_cores = required_cores
+        self.available_cores = available_cores
+
+
+def stream_priority(stream):
+    """Favorites and streams in a priority category may use the reserved headroom"""
+    categories = getattr(settings, 'STREAM_PRIORITY_CATEGORIES', ('security',))
+    if stream and (stream.is_favorite or stream.category in categories):
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+def stream_size(stream):
+    """(width, height, fps) from the stream's metadata, DEFAULT_SOURCE_SIZE where unknown"""
+    width, height, fps = DEFAULT_SOURCE_SIZE
+    metadata = stream.get_metadata() if stream else {}
+    resolution = parse_resolution(metadata.get('resolution'))
+    if resolution:
+        width, height = resolution
+    try:
+        fps = float(metadata.get('fps') or fps)
+    except (TypeError, ValueError):
+        pass
+    return width, height, fps
+
+
+def degrade_chain(profile):
+    """The requested profile followed by every cheaper profile it may fall back to"""
+    chain = [profile]
+    while chain[-1] in DEGRADED_PROFILES:
+        chain.append(DEGRADED_PROFILES[chain[-1]])
+    return chain
+
+
+class TranscodeScheduler:
+    """Admits new ingests against a budget of CPU cores, estimated from their profile
+
+    Normal-priority ingests may only use the budget minus a reserved share, so a
+    favorite or security camera can still start when the box is busy with the rest.
+    Sources are keyed like the hub's and hold their estimate until released.
+    """
+
+    def __init__(self, budget_cores, reserve=0.25):
+        self.budget_cores = budget_cores
+        self.reserve = reserve
+        self.admitted = {}
+        self.refused = 0
+        self.degraded = 0
+
+    @property
+    def used_cores(self):
+        return sum(self.admitted.values())
+
+    def limit(self, priority):
+        if priority == PRIORITY_HIGH:
+            return self.budget_cores
+        return self.budget_cores * (1 - self.reserve)
+
+    def available(self, priority):
+        return max(0.0, self.limit(priority) - self.used_cores)
+
+    def estimate(self, profile, size=None):
+        width, height, fps = size or DEFAULT_SOURCE_SIZE
+        return estimate_cpu_cores(profile, width, height, fps)
+
+    def estimate_mosaic(self, width, height, fps):
+        return estimate_cpu_cores(PROFILE_TRANSCODE, width, height, fps)
+
+    def admit(self, key, cost, priority=PRIORITY_NORMAL, degraded=False):
+        """Reserve cost cores for the source under key if they fit, returning whether they did
+
+        An idle box always takes one ingest, however expensive, so small hosts are not
+        left unable to show anything.
+        """
+        if self.admitted and cost > self.available(priority):
+            return False
+        self.admitted[key] = cost
+        if degraded:
+            self.degraded += 1
+        return True
+
+    def refuse(self, cost, priority=PRIORITY_NORMAL):
+        self.refused += 1
+        available = self.available(priority)
+        return AdmissionRefused(
+            f"Not enough CPU to start this stream: needs {cost:.2f} cores, "
+            f"{available:.2f} of {self.budget_cores:.2f} available at {priority} priority",
+            cost,
+            available,
+        )
+
+    def release(self, key):
+        self.admitted.pop(key, None)
+
+    def stats(self):
+        return {
+            'budget_cores': round(self.budget_cores, 2),
+            'reserved_cores': round(self.budget_cores * self.reserve, 2),
+            'used_cores': round(self.used_cores, 2),
+            'admitted': len(self.admitted),
+            'degraded': self.degraded,
+            'refused': self.refused,
+        }
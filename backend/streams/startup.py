@@ -0,0 +1,50 @@
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .models import Stream
+from .profiles import INGEST_DEFAULT, INGEST_PROFILES
+
+logger = logging.getLogger(__name__)
+
+# Startup milestones, in the order a healthy ingest reaches them
+MILESTONES = ('connect', 'first_byte', 'init_segment', 'keyframe')
+
+
+def stream_ingest_profile(stream):
+    """The stream's metadata ingest_profile, or STREAM_DEFAULT_INGEST_PROFILE"""
+    default = getattr(settings, 'STREAM_DEFAULT_INGEST_PROFILE', INGEST_DEFAULT)
+    name = stream.get_metadata().get('ingest_profile') if stream else None
+    if name is None:
+        return default
+    if name not in INGEST_PROFILES:
+        logger.warning(f"Unknown ingest profile {name!r} for stream {stream.pk}, using {default}")
+        return default
+    return name
+
+
+def startup_timings(started_at, reached):
+    """Seconds from process start to each milestone in reached, None where it was never seen"""
+    return {
+        name: round(reached[name] - started_at, 3) if reached.get(name) is not None else None
+        for name in MILESTONES
+    }
+
+
+def fastest_ingest_profile(metadata):
+    """The ingest profile with the lowest mean time to first keyframe, or None before any start"""
+    startup = (metadata or {}).get('startup') or {}
+    measured = [
+        (entry['mean']['keyframe'], name)
+        for name, entry in startup.items()
+        if entry.get('mean', {}).get('keyframe') is not None
+    ]
+    return min(measured)[1] if measured else None
+
+
+@database_sync_to_async
+def record_startup(rtsp_url, ingest_profile, timings):
+    try:
+        for stream in Stream.objects.filter(url=rtsp_url):
+            stream.record_startup(ingest_profile, timings)
+    except Exception as e:
+        logger.error(f"Could not record startup timings: {str(e)}")
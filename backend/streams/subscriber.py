@@ -0,0 +1,130 @@
+import asyncio
+import time
+from collections import deque
+from .frames import FLAG_INIT_SEGMENT, FLAG_KEYFRAME
+
+
+class Subscriber:
+    """One viewer attached to a shared stream source
+
+    Media is queued per viewer so a slow connection never holds up the ingest. The
+    queue is bounded in bytes and in fragments; when a viewer falls behind, everything
+    queued is dropped and delivery resumes at the next keyframe fragment.
+    """
+
+    def __init__(self, name=None, stream_id=None, max_bytes=4 * 1024 * 1024, max_fragments=16, notify=None):
+        self.name = name
+        self.stream_id = stream_id
+        # Called whenever media or end-of-stream is queued, for senders serving many queues
+        self.notify = notify
+        self.rendition = None
+        self.adaptive = False
+        self.max_bytes = max_bytes
+        self.max_fragments = max_fragments
+        self.items = deque()
+        self.queued_bytes = 0
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.waiting_for_keyframe = False
+
+        self.delivered_fragments = 0
+        self.delivered_bytes = 0
+        self.dropped_fragments = 0
+        self.dropped_bytes = 0
+        self.skips = 0
+        self.max_lag = 0.0
+
+    def deliver(self, data, flags=0):
+        if self.closed:
+            return
+        if not flags & FLAG_INIT_SEGMENT:
+            if self.waiting_for_keyframe:
+                if not flags & FLAG_KEYFRAME:
+                    self._count_drop(data)
+                    return
+                self.waiting_for_keyframe = False
+
+            if (len(self.items) >= self.max_fragments
+                    or self.queued_bytes + len(data) > self.max_bytes):
+                self._skip_to_keyframe()
+                if not flags & FLAG_KEYFRAME:
+                    self.waiting_for_keyframe = True
+                    self._count_drop(data)
+                    return
+
+        self.items.append((data, flags, time.monotonic()))
+        self.queued_bytes += len(data)
+        self.ready.set()
+        if self.notify:
+            self.notify()
+
+    def _skip_to_keyframe(self):
+        # Init segments stay queued: the client cannot decode anything without them
+        kept = deque()
+        for item in self.items:
+            if item[1] & FLAG_INIT_SEGMENT:
+                kept.append(item)
+            else:
+                self._count_drop(item[0])
+                self.queued_bytes -= len(item[0])
+        self.items = kept
+        self.skips += 1
+
+    def _count_drop(self, data):
+        self.dropped_fragments += 1
+        self.dropped_bytes += len(data)
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+        if self.notify:
+            self.notify()
+
+    async def get(self):
+        """Return the next (data, flags) pair, or None once the source has ended"""
+        while not self.items:
+            if self.closed:
+                return None
+            self.ready.clear()
+            await self.ready.wait()
+        return self.get_nowait()
+
+    @property
+    def next_size(self):
+        """Size of the next queued item, or None when the queue is empty"""
+        return len(self.items[0][0]) if self.items else None
+
+    def get_nowait(self):
+        """Return the next (data, flags) pair, or None when nothing is queued"""
+        if not self.items:
+            return None
+        data, flags, queued_at = self.items.popleft()
+        self.queued_bytes -= len(data)
+        self.max_lag = max(self.max_lag, time.monotonic() - queued_at)
+        self.delivered_fragments += 1
+        self.delivered_bytes += len(data)
+        return data, flags
+
+    @property
+    def lag(self):
+        """Seconds the oldest queued fragment has been waiting"""
+        if not self.items:
+            return 0.0
+        return time.monotonic() - self.items[0][2]
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'stream_id': self.stream_id,
+            'rendition': self.rendition,
+            'adaptive': self.adaptive,
+            'queued_fragments': len(self.items),
+            'queued_bytes': self.queued_bytes,
+            'lag': round(self.lag, 3),
+            'max_lag': round(self.max_lag, 3),
+            'delivered_fragments': self.delivered_fragments,
+            'delivered_bytes': self.delivered_bytes,
+            'dropped_fragments': self.dropped_fragments,
+            'dropped_bytes': self.dropped_bytes,
+            'skips': self.skips,
+        }
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import random
+import time
+from .ingest import FFmpegIngest
+
+logger = logging.getLogger(__name__)
+
+
+class IngestSupervisor:
+    """Owns an FFmpeg ingest and restarts it when it exits or stalls
+
+    Restarts back off exponentially with full jitter, so a site full of cameras that
+    drop together does not reconnect in lockstep. A run that stayed up longer than
+    stable_after seconds resets the backoff. on_chunk(output, chunk) receives media,
+    on_restart() is called before the replacement process starts and on_exit() once
+    the supervisor gives up or is stopped. on_progress(report) gets the live
+    process's FFmpeg progress reports.
+    """
+
+    def __init__(self, command, outputs, on_chunk, on_restart=None, on_exit=None, label='ingest',
+                 stall_timeout=10.0, backoff_base=0.25, backoff_max=30.0, max_attempts=0,
+                 stable_after=30.0, on_progress=None):
+        self.on_progress = on_progress
+        self.ingest = FFmpegIngest(command, on_progress=self._progress)
+        self.outputs = outputs
+        self.on_chunk = on_chunk
+        self.on_restart = on_restart
+        self.on_exit = on_exit
+        self.label = label
+        self.stall_timeout = stall_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+        self.stable_after = stable_after
+
+        self.task = None
+        self.state = 'stopped'
+        self.restarts = 0
+        self.last_restart_reason = None
+        self.last_data_at = None
+        # Replacement process started alongside the live one, see replace()
+        self.candidate = None
+        self.candidate_pumps = []
+        self.replace_task = None
+        self.replaced = asyncio.Event()
+        self.replacements = 0
+
+    @property
+    def running(self):
+        return self.ingest.running
+
+    def cpu_percent(self):
+        return self.ingest.cpu_percent()
+
+    async def start(self):
+        """Start the first process; spawn errors propagate to the caller"""
+        await self.ingest.start()
+        self.state = 'running'
+        self.task = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        attempt = 0
+        try:
+            while True:
+                started_at = time.monotonic()
+                reason = await self._run_once()
+                if reason == 'replaced':
+                    continue
+                await self._cancel_replace()
+                await self.ingest.stop()
+                if time.monotonic() - started_at >= self.stable_after:
+                    attempt = 0
+                attempt += 1
+                if self.max_attempts and attempt > self.max_attempts:
+                    logger.error(f"Giving up on {self.label} after {self.max_attempts} restarts ({reason})")
+                    break
+
+                self.state = 'restarting'
+                self.last_restart_reason = reason
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                logger.warning(f"Restarting {self.label} in {delay:.2f}s ({reason})")
+                await asyncio.sleep(delay)
+
+                if self.on_restart:
+                    self.on_restart()
+                try:
+                    await self.ingest.start()
+                except OSError as e:
+                    logger.error(f"Could not restart {self.label}: {str(e)}")
+                    continue
+                self.restarts += 1
+                self.state = 'running'
+        except asyncio.CancelledError:
+            raise
+        finally:
+            self.state = 'stopped'
+            if self.on_exit:
+                self.on_exit()
+
+    async def _run_once(self):
+        """Pump every output until one of them ends or no output produces data in time"""
+        if not self.ingest.running:
+            return 'exited'
+        self.last_data_at = time.monotonic()
+        self.replaced.clear()
+        tasks = [asyncio.create_task(self._pump(self.ingest, output)) for output in range(self.outputs)]
+        tasks.append(asyncio.create_task(self._watch_stall()))
+        tasks.append(asyncio.create_task(self._watch_replaced()))
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            return next(iter(done)).result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _pump(self, ingest, output):
+        try:
+            while True:
+                chunk = await ingest.read(output)
+                if ingest is not self.ingest:
+                    # Replaced while reading; this output now belongs to the new process
+                    return 'replaced'
+                if not chunk:
+                    return 'exited'
+                self.last_data_at = time.monotonic()
+                self.on_chunk(output, chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading {self.label}: {str(e)}")
+            return 'error'
+
+    async def _watch_stall(self):
+        while True:
+            await asyncio.sleep(self.stall_timeout / 4)
+            if time.monotonic() - self.last_data_at > self.stall_timeout:
+                return 'stalled'
+
+    async def _watch_replaced(self):
+        await self.replaced.wait()
+        return 'replaced'
+
+    def replace(self, on_chunk, timeout=10.0):
+        """Start a second process beside the live one without interrupting it
+
+        Its output goes to on_chunk(output, chunk) until the caller calls promote(),
+        which makes it the live process and stops the old one. A replacement that
+        exits or is not promoted within timeout seconds is dropped. Returns False if
+        one is already pending.
+        """
+        if self.replace_task and not self.replace_task.done():
+            return False
+        self.replace_task = asyncio.create_task(self._replace(on_chunk, timeout))
+        return True
+
+    async def _replace(self, on_chunk, timeout):
+        candidate = FFmpegIngest(self.ingest.command, on_progress=self._progress)
+        try:
+            await candidate.start()
+        except OSError as e:
+            logger.error(f"Could not start a replacement for {self.label}: {str(e)}")
+            return
+        self.candidate = candidate
+        self.candidate_pumps = [
+            asyncio.create_task(self._pump_candidate(candidate, output, on_chunk)) for output in range(self.outputs)
+        ]
+        try:
+            await asyncio.wait(self.candidate_pumps, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if self.candidate is candidate:
+                logger.warning(f"Dropping the replacement for {self.label}: no keyframe in time")
+                self.candidate = None
+                for task in self.candidate_pumps:
+                    task.cancel()
+                await asyncio.gather(*self.candidate_pumps, return_exceptions=True)
+                await candidate.stop()
+            self.candidate_pumps = []
+
+    async def _pump_candidate(self, candidate, output, on_chunk):
+        try:
+            while self.candidate is candidate:
+                chunk = await candidate.read(output)
+                if not chunk:
+                    return
+                on_chunk(output, chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading the replacement for {self.label}: {str(e)}")
+
+    def _progress(self, ingest, report):
+        # A replacement still being staged reports too; only the live process counts
+        if ingest is self.ingest and self.on_progress:
+            self.on_progress(report)
+
+    def promote(self):
+        """Make the replacement the live process; call from its on_chunk"""
+        candidate, self.candidate = self.candidate, None
+        if candidate is None:
+            return
+        previous, self.ingest = self.ingest, candidate
+        current = asyncio.current_task()
+        for task in self.candidate_pumps:
+            if task is not current:
+                task.cancel()
+        self.replacements += 1
+        self.replaced.set()
+        asyncio.create_task(previous.stop())
+
+    async def _cancel_replace(self):
+        if self.replace_task and self.replace_task is not asyncio.current_task():
+            self.replace_task.cancel()
+            try:
+                await self.replace_task
+            except asyncio.CancelledError:
+                pass
+        self.replace_task = None
+
+    async def stop(self):
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+        await self._cancel_replace()
+        await self.ingest.stop()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'restarts': self.restarts,
+            'last_restart_reason': self.last_restart_reason,
+            'replacements': self.replacements,
+        }
@@ -0,0 +1,146 @@
+import re
+import time
+
+# key=value lines FFmpeg writes with -progress; a progress= line closes each report
+PROGRESS_LINE = re.compile(r'^([a-z0-9_]+)=(.*)$')
+
+# Per-process counters that start over when FFmpeg restarts or is replaced
+COUNTERS = ('frames', 'dropped_frames', 'duplicated_frames', 'total_size')
+
+# Keys of StreamMetrics.as_dict()
+METRICS_FIELDS = (
+    'fps', 'bitrate_kbps', 'speed', 'frames', 'dropped_frames', 'duplicated_frames', 'bytes',
+    'uptime', 'reconnects', 'age',
+)
+
+
+def _number(value, suffix=''):
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_progress(fields):
+    """Numbers from one -progress report; N/A and missing fields become None"""
+    out_time_us = _number(fields.get('out_time_us', ''))
+    return {
+        'frames': _number(fields.get('frame', '')),
+        'fps': _number(fields.get('fps', '')),
+        'bitrate_kbps': _number(fields.get('bitrate', ''), 'kbits/s'),
+        'total_size': _number(fields.get('total_size', '')),
+        'out_time': out_time_us / 1_000_000 if out_time_us is not None else None,
+        'dropped_frames': _number(fields.get('drop_frames', '')),
+        'duplicated_frames': _number(fields.get('dup_frames', '')),
+        'speed': _number(fields.get('speed', ''), 'x'),
+    }
+
+
+class ProgressParser:
+    """Collects FFmpeg -progress lines from stderr into one report per period"""
+
+    def __init__(self):
+        self.fields = {}
+
+    def feed(self, line):
+        """Take one stderr line; returns True if it was a progress line"""
+        match = PROGRESS_LINE.match(line)
+        if not match:
+            return False
+        self.fields[match.group(1)] = match.group(2)
+        return True
+
+    def report(self):
+        """The parsed report once a progress= line has completed one, else None"""
+        if 'progress' not in self.fields:
+            return None
+        fields, self.fields = self.fields, {}
+        return parse_progress(fields)
+
+
+class StreamMetrics:
+    """Latest FFmpeg progress for one ingest, with counters kept across restarts"""
+
+    def __init__(self, key):
+        self.key = key
+        self.started_at = time.time()
+        self.updated_at = None
+        self.reconnects = 0
+        self.current = {}
+        # Counters of earlier processes, added to the current process's
+        self.base = dict.fromkeys(COUNTERS, 0)
+
+    def update(self, report):
+        if (report['frames'] or 0) < (self.current.get('frames') or 0):
+            # A new process: its counters start at zero again
+            self.fold()
+        self.current = report
+        self.updated_at = time.time()
+
+    def fold(self):
+        for name in COUNTERS:
+            self.base[name] += self.current.get(name) or 0
+        self.current = {}
+
+    def restarted(self):
+        self.reconnects += 1
+        self.fold()
+
+    def total(self, name):
+        return int(self.base[name] + (self.current.get(name) or 0))
+
+    def as_dict(self):
+        now = time.time()
+        current = self.current
+        bitrate = current.get('bitrate_kbps')
+        if bitrate is None and current.get('total_size') and current.get('out_time'):
+            bitrate = current['total_size'] * 8 / 1000 / current['out_time']
+        return {
+            'fps': current.get('fps'),
+            'bitrate_kbps': round(bitrate, 1) if bitrate is not None else None,
+            'speed': current.get('speed'),
+            'frames': self.total('frames'),
+            'dropped_frames': self.total('dropped_frames'),
+            'duplicated_frames': self.total('duplicated_frames'),
+            'bytes': self.total('total_size'),
+            'uptime': round(now - self.started_at, 1),
+            'reconnects': self.reconnects,
+            'age': round(now - self.updated_at, 1) if self.updated_at else None,
+        }
+
+
+class MetricsRegistry:
+    """StreamMetrics of every running ingest, found by source key or camera URL in O(1)"""
+
+    def __init__(self):
+        self.streams = {}
+        self.urls = {}
+
+    def register(self, key):
+        metrics = StreamMetrics(key)
+        self.streams[key] = metrics
+        self.urls[key[0]] = key
+        return metrics
+
+    def unregister(self, key, metrics):
+        """Drop metrics unless a newer ingest has registered under the same key since"""
+        if self.streams.get(key) is not metrics:
+            return
+        del self.streams[key]
+        if self.urls.get(key[0]) == key:
+            # Fall back to another profile of the same camera if one is still running
+            other = next((other for other in self.streams if other[0] == key[0]), None)
+            if other:
+                self.urls[key[0]] = other
+            else:
+                del self.urls[key[0]]
+
+    def get(self, rtsp_url):
+        key = self.urls.get(rtsp_url)
+        return self.streams.get(key) if key else None
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,135 @@
+import time
+from array import array
+from django.conf import settings
+
+# Metrics kept per camera, sampled from each FFmpeg progress report
+HISTORY_METRICS = ('fps', 'bitrate_kbps', 'speed', 'dropped_frames', 'duplicated_frames', 'reconnects')
+
+# (seconds per point, points kept): 5 minutes at 1s, 2 hours at 10s, 24 hours at 1m
+HISTORY_TIERS = ((1, 300), (10, 720), (60, 1440))
+
+
+class Tier:
+    """A ring of fixed-width time buckets holding the mean of each metric in the bucket
+
+    Slot i holds bucket number epochs[i]; a write to a newer bucket that maps to the
+    same slot overwrites it, so stale data ages out without any sweeping. Each metric
+    counts its own samples, so reports that lack it do not drag its mean toward 0.
+    Everything lives in preallocated arrays, about 4 + 6 * len(metrics) bytes per point.
+    """
+
+    def __init__(self, resolution, capacity, metrics):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.epochs = array('I', bytes(4 * capacity))
+        self.counts = {name: array('H', bytes(2 * capacity)) for name in metrics}
+        self.sums = {name: array('f', bytes(4 * capacity)) for name in metrics}
+
+    def add(self, timestamp, values):
+        bucket = int(timestamp // self.resolution)
+        slot = bucket % self.capacity
+        if self.epochs[slot] != bucket:
+            self.epochs[slot] = bucket
+            for name in self.sums:
+                self.counts[name][slot] = 0
+                self.sums[name][slot] = 0.0
+        for name, value in values.items():
+            if value is None or name not in self.sums or self.counts[name][slot] == 0xFFFF:
+                continue
+            self.counts[name][slot] += 1
+            self.sums[name][slot] += value
+
+    def query(self, start, end, metrics):
+        """Columns of bucket start times and per-metric means for buckets in [start, end]
+
+        A metric with no samples in a bucket that others have is None there.
+        """
+        first = max(int(start // self.resolution), int(end // self.resolution) - self.capacity + 1)
+        last = int(end // self.resolution)
+        timestamps = []
+        columns = {name: [] for name in metrics}
+        for bucket in range(first, last + 1):
+            slot = bucket % self.capacity
+            counts = [self.counts[name][slot] for name in metrics]
+            if self.epochs[slot] != bucket or not any(counts):
+                continue
+            timestamps.append(bucket * self.resolution)
+            for name, count in zip(metrics, counts):
+                columns[name].append(round(self.sums[name][slot] / count, 3) if count else None)
+        return timestamps, columns
+
+    @property
+    def retention(self):
+        return self.resolution * self.capacity
+
+
+class SeriesSet:
+    """Every tier of history for one camera; each sample is rolled into all of them at once"""
+
+    def __init__(self, tiers=HISTORY_TIERS, metrics=HISTORY_METRICS):
+        self.metrics = metrics
+        self.tiers = [Tier(resolution, capacity, metrics) for resolution, capacity in tiers]
+
+    def add(self, values, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+    def tier_for(self, start, end, resolution=None):
+        """The requested resolution, or the finest tier still holding start"""
+        if resolution is not None:
+            return next((tier for tier in self.tiers if tier.resolution == resolution), None)
+        now = time.time()
+        for tier in self.tiers:
+            if start >= now - tier.retention:
+                return tier
+        return self.tiers[-1]
+
+
+class HistoryStore:
+    """Metric history per camera URL, capped at max_series cameras
+
+    When full, the camera written to least recently is dropped, so memory is bounded
+    by max_series times the fixed size of one SeriesSet.
+    """
+
+    def __init__(self, max_series=1000, tiers=HISTORY_TIERS, metrics=HISTORY_METRICS):
+        self.max_series = max_series
+        self.tiers = tiers
+        self.metrics = metrics
+        self.series = {}
+
+    def record(self, rtsp_url, values, timestamp=None):
+        series = self.series.pop(rtsp_url, None)
+        if series is None:
+            if len(self.series) >= self.max_series:
+                # Dicts keep insertion order and every write re-inserts, so the first is the stalest
+                del self.series[next(iter(self.series))]
+            series = SeriesSet(self.tiers, self.metrics)
+        self.series[rtsp_url] = series
+        series.add(values, timestamp)
+
+    def query(self, rtsp_url, start, end, metrics=None, resolution=None):
+        """Columnar history, or None if the camera has none or the resolution is not kept"""
+        series = self.series.get(rtsp_url)
+        if series is None:
+            return None
+        tier = series.tier_for(start, end, resolution)
+        if tier is None:
+            return None
+        metrics = [name for name in (metrics or self.metrics) if name in self.metrics]
+        timestamps, columns = tier.query(start, end, metrics)
+        return {'resolution': tier.resolution, 'start': start, 'end': end, 'timestamps': timestamps, **columns}
+
+    def stats(self):
+        per_series = sum(capacity * (4 + (2 + 4) * len(self.metrics)) for _, capacity in self.tiers)
+        return {
+            'series': len(self.series),
+            'max_series': self.max_series,
+            'bytes_per_series': per_series,
+            'bytes': per_series * len(self.series),
+            'max_bytes': per_series * self.max_series,
+        }
+
+
+history = HistoryStore(getattr(settings, 'STREAM_HISTORY_MAX_STREAMS', 1000))
@@ -1,33 +1,130 @@
-from rest_framework import viewsets, status
+from rest_framework import renderers, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.http import JsonResponse
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import json
+import math
 import subprocess
 import base64
 import threading
 import time
+from .hub import hub
+from .listing import StreamCursorPagination, StreamFilterBackend
+from .liveness import sweeper
 from .models import Stream
-from .serializers import StreamSerializer
+from .probe import probe_batch, probe_stream
+from .rtsp import is_rtsp_url
+from .serializers import StreamSerializer, requested_fields
+from .startup import fastest_ingest_profile, stream_ingest_profile
+from .telemetry import METRICS_FIELDS, registry
+from .timeseries import HISTORY_TIERS, history
+
+VALIDATION_METADATA = ('codec', 'profile', 'level', 'resolution', 'fps', 'audio_codec', 'server', 'methods')
+
+
+def validation_result(result):
+    """The validate_stream response body for a probe result"""
+    return {
+        'valid': result['valid'],
+        'reachable': result['reachable'],
+        'error': result['error'],
+        'cached': result['cached'],
+        'metadata': {key: result.get(key) for key in VALIDATION_METADATA},
+    }
+
+
+class NDJSONRenderer(renderers.JSONRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class EventStreamRenderer(renderers.JSONRenderer):
+    """Lets clients ask for text/event-stream; error responses go out as JSON, see batch_error"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+
+def batch_error(request, message):
+    """A 400 for validate_batch, rendered as JSON whatever the client accepted
+
+    An EventSource cannot read a JSON body served as text/event-stream.
+    """
+    request.accepted_renderer = renderers.JSONRenderer()
+    request.accepted_media_type = renderers.JSONRenderer.media_type
+    return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def encode_event(payload, sse, event='result'):
+    data = json.dumps(payload)
+    if sse:
+        return f'event: {event}\ndata: {data}\n\n'
+    return data + '\n'
+
+
+async def batch_validation(urls, sse):
+    """One NDJSON line or SSE event per URL as its probe finishes, then a summary"""
+    started = time.monotonic()
+    valid = 0
+    positions = []
+    for index, url in enumerate(urls):
+        if is_rtsp_url(url):
+            positions.append(index)
+        else:
+            yield encode_event({'index': index, 'valid': False, 'error': 'Invalid RTSP URL format'}, sse)
+
+    async for index, result in probe_batch([urls[position] for position in positions]):
+        valid += result['valid']
+        yield encode_event({'index': positions[index], 'url': result['url'], **validation_result(result)}, sse)
+
+    yield encode_event({
+        'done': True,
+        'total': len(urls),
+        'valid': valid,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+    }, sse, 'done')
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class StreamViewSet(viewsets.ModelViewSet):
     queryset = Stream.objects.all()
     serializer_class = StreamSerializer
+    pagination_class = StreamCursorPagination
+    filter_backends = [StreamFilterBackend]
+
+    def get_queryset(self):
+        return self.project(super().get_queryset())
+
+    def get_serializer(self, *args, **kwargs):
+        fields = requested_fields(self.request)
+        if fields:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def project(self, queryset):
+        """Load only the requested ?fields= columns"""
+        fields = requested_fields(self.request)
+        return queryset.only(*fields) if fields else queryset
+
+    def paginated(self, queryset):
+        queryset = self.filter_queryset(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(self.get_serializer(queryset, many=True).data)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
     @action(detail=False, methods=['get'])
     def active(self, request):
-        active_streams = Stream.objects.filter(is_active=True)
-        serializer = self.get_serializer(active_streams, many=True)
-        return Response(serializer.data)
+        active_streams = self.get_queryset().filter(is_active=True)
+        return self.paginated(active_streams)
 
     @action(detail=False, methods=['get'])
     def favorites(self, request):
-        favorite_streams = Stream.objects.filter(is_favorite=True)
-        serializer = self.get_serializer(favorite_streams, many=True)
-        return Response(serializer.data)
+        favorite_streams = self.get_queryset().filter(is_favorite=True)
+        return self.paginated(favorite_streams)
 
     @action(detail=True, methods=['post'])
     def toggle_favorite(self, request, pk=None):
@@ -54,40 +151,107 @@ class StreamViewSet(viewsets.ModelViewSet):
         
         try:
             # Simple validation - check if URL format is correct
-            if not rtsp_url.startswith('rtsp://'):
+            if not is_rtsp_url(rtsp_url):
                 return Response({'valid': False, 'error': 'Invalid RTSP URL format'})
-            
-            # For Vercel deployment, we'll simulate stream validation
-            # In production, you'd use FFmpeg to probe the stream
-            return Response({
-                'valid': True,
-                'metadata': {
-                    'resolution': '1920x1080',
-                    'fps': 30,
-                    'codec': 'H.264'
-                }
-            })
+
+            # OPTIONS/DESCRIBE against the camera; the SDP tells codec, resolution and fps
+            result = async_to_sync(probe_stream)(rtsp_url)
+            return Response(validation_result(result))
         except Exception as e:
             return Response({'valid': False, 'error': str(e)}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'],
+            renderer_classes=[renderers.JSONRenderer, NDJSONRenderer, EventStreamRenderer])
+    def validate_batch(self, request):
+        """Validate many RTSP URLs concurrently, streaming results as they finish
+
+        Responds with NDJSON, or with server-sent events when the client accepts
+        text/event-stream. Each result carries the index of its URL in the request.
+        The body is an async generator, so it only streams under ASGI, as the Procfile
+        serves the app; a WSGI server would hold it back until the batch is done.
+        """
+        urls = request.data.get('urls')
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            return batch_error(request, 'urls must be a list of RTSP URLs')
+        max_urls = getattr(settings, 'STREAM_BATCH_MAX_URLS', 1000)
+        if len(urls) > max_urls:
+            return batch_error(request, f'At most {max_urls} URLs per batch')
+
+        sse = request.accepted_renderer.media_type == EventStreamRenderer.media_type
+        response = StreamingHttpResponse(
+            batch_validation([url.strip() for url in urls], sse),
+            content_type='text/event-stream' if sse else 'application/x-ndjson',
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Keep proxies from holding results back until the batch is done
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
     @action(detail=False, methods=['get'])
     def stream_data(self, request):
-        """Simulate stream data for demo purposes"""
+        """Live FFmpeg telemetry of the stream's ingest in this process, if it is running"""
         stream_id = request.GET.get('stream_id')
         if not stream_id:
             return Response({'error': 'Stream ID required'}, 
                           status=status.HTTP_400_BAD_REQUEST)
-        
-        # Simulate stream data
-        mock_data = {
+
+        stream = Stream.objects.filter(pk=stream_id).only('url', 'metadata').first() if stream_id.isdigit() else None
+        if stream is None:
+            return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        metrics = registry.get(stream.url)
+        data = metrics.as_dict() if metrics else dict.fromkeys(METRICS_FIELDS)
+        bitrate = data['bitrate_kbps']
+        return Response({
             'stream_id': stream_id,
-            'status': 'connected',
-            'bandwidth': 2048,  # KB/s
-            'fps': 30,
-            'resolution': '1920x1080',
-            'uptime': 3600,  # seconds
+            'status': 'connected' if metrics else 'idle',
+            'bandwidth': round(bitrate / 8, 1) if bitrate is not None else None,  # KB/s
+            'resolution': stream.get_metadata().get('resolution'),
+            **data,
             'timestamp': time.time()
-        }
-        
-        return Response(mock_data)
+        })
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """Metric history as columns: ?start=&end= (unix seconds), metrics=fps,bitrate_kbps, resolution=1|10|60"""
+        stream = self.get_object()
+        try:
+            end = float(request.GET.get('end') or time.time())
+            start = float(request.GET.get('start') or end - 3600)
+            resolution = int(request.GET['resolution']) if request.GET.get('resolution') else None
+            if not (math.isfinite(start) and math.isfinite(end)):
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'start, end and resolution must be numbers'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        if resolution is not None and resolution not in (seconds for seconds, _ in HISTORY_TIERS):
+            return Response({'error': f'resolution must be one of {[seconds for seconds, _ in HISTORY_TIERS]}'},
+                          status=status.HTTP_400_BAD_REQUEST)
+        metrics = [name for name in request.GET.get('metrics', '').split(',') if name] or None
+
+        data = history.query(stream.url, start, end, metrics, resolution)
+        if data is None:
+            data = {'resolution': resolution, 'start': start, 'end': end, 'timestamps': []}
+        return Response({'stream_id': stream.pk, **data})
+
+    @action(detail=True, methods=['get'])
+    def startup(self, request, pk=None):
+        """Mean and last time to connect, first byte, init segment and keyframe per ingest profile"""
+        stream = self.get_object()
+        metadata = stream.get_metadata()
+        return Response({
+            'ingest_profile': stream_ingest_profile(stream),
+            'fastest': fastest_ingest_profile(metadata),
+            'profiles': metadata.get('startup', {}),
+        })
+
+    @action(detail=False, methods=['get'])
+    def hub_stats(self, request):
+        """Shared ingests in this process: CPU use and savings, per-viewer lag and drops"""
+        return Response({
+            **hub.stats(),
+            'liveness': sweeper.stats(),
+            'history': history.stats(),
+            'timestamp': time.time(),
+        })
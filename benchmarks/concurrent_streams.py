@@ -0,0 +1,118 @@
+"""Concurrent streams per ASGI worker: blocking Popen reads vs asyncio subprocess pipes.
+
+Each simulated camera is a child process that writes 8 KB chunks at a fixed rate,
+standing in for FFmpeg. A stream counts as held while it receives at least 95% of
+its source rate and the event loop stays responsive (heartbeat lag under 50 ms).
+
+    python benchmarks/concurrent_streams.py [--streams 1,5,10,25,50,100] [--seconds 3]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from streams.ingest import FFmpegIngest  # noqa: E402
+
+CHUNK_SIZE = 8192
+CHUNKS_PER_SECOND = 25  # ~1.6 Mbit/s, a typical 720p camera
+
+SOURCE = (
+    "import sys, time\n"
+    f"chunk = b'x' * {CHUNK_SIZE}\n"
+    "while True:\n"
+    "    sys.stdout.buffer.write(chunk)\n"
+    "    sys.stdout.buffer.flush()\n"
+    f"    time.sleep({1 / CHUNKS_PER_SECOND})\n"
+)
+COMMAND = [sys.executable, '-c', SOURCE]
+
+
+async def heartbeat(lags, stop):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def run_blocking(count, seconds):
+    processes = [
+        subprocess.Popen(COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        for _ in range(count)
+    ]
+    received = [0] * count
+    deadline = time.perf_counter() + seconds
+
+    async def reader(index):
+        # This is the old StreamConsumer.stream_video loop
+        while time.perf_counter() < deadline:
+            chunk = processes[index].stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            received[index] += len(chunk)
+            await asyncio.sleep(0)
+
+    try:
+        return await measure([reader(i) for i in range(count)], received, seconds)
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+
+
+async def run_async(count, seconds):
+    ingests = [FFmpegIngest(COMMAND, read_size=CHUNK_SIZE) for _ in range(count)]
+    await asyncio.gather(*(ingest.start() for ingest in ingests))
+    received = [0] * count
+    deadline = time.perf_counter() + seconds
+
+    async def reader(index):
+        while time.perf_counter() < deadline:
+            try:
+                chunk = await asyncio.wait_for(ingests[index].read(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            received[index] += len(chunk)
+
+    try:
+        return await measure([reader(i) for i in range(count)], received, seconds)
+    finally:
+        await asyncio.gather(*(ingest.stop() for ingest in ingests))
+
+
+async def measure(readers, received, seconds):
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*readers)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await beat
+
+    expected = CHUNK_SIZE * CHUNKS_PER_SECOND * elapsed
+    worst_lag = max(lags, default=elapsed)
+    held = sum(1 for total in received if total >= 0.95 * expected) if worst_lag < 0.05 else 0
+    return held, sum(received) / elapsed / 1e6, worst_lag * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', default='1,5,10,25,50,100')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'streams':>8} {'mode':>9} {'held':>6} {'MB/s':>8} {'max lag ms':>11}")
+    for count in [int(n) for n in args.streams.split(',')]:
+        for mode, runner in (('blocking', run_blocking), ('asyncio', run_async)):
+            held, throughput, lag = asyncio.run(runner(count, args.seconds))
+            print(f"{count:>8} {mode:>9} {held:>6} {throughput:>8.2f} {lag:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Per-chunk cost of base64-in-JSON media messages vs binary frames with a fixed header.
+
+    python benchmarks/frame_transport.py [--chunks 20000] [--chunk-size 8192]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from streams.frames import encode_frame  # noqa: E402
+
+
+def encode_json(chunk, sequence):
+    return json.dumps({
+        'type': 'stream_chunk',
+        'chunk': base64.b64encode(chunk).decode('utf-8')
+    })
+
+
+def encode_binary(chunk, sequence):
+    return encode_frame(1, sequence, chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--chunk-size', type=int, default=8192)
+    args = parser.parse_args()
+
+    chunk = os.urandom(args.chunk_size)
+    payload = args.chunks * args.chunk_size
+    print(f"{'mode':>7} {'wire bytes':>12} {'overhead':>9} {'MB/s':>9} {'us/chunk':>9}")
+    for mode, encode in (('json', encode_json), ('binary', encode_binary)):
+        wire = 0
+        started = time.perf_counter()
+        for sequence in range(args.chunks):
+            wire += len(encode(chunk, sequence))
+        elapsed = time.perf_counter() - started
+        print(f"{mode:>7} {wire:>12} {wire / payload - 1:>8.1%} "
+              f"{payload / elapsed / 1e6:>9.0f} {elapsed / args.chunks * 1e6:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
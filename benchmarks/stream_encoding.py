@@ -0,0 +1,69 @@
+"""Encoding the full stream list in the serverless API, from the old indent=2 json.dumps to cached fragments.
+
+Times each way of turning N streams into the /api/streams body, then gzip and (if
+installed) brotli on the result, and reports milliseconds per response and bytes.
+
+    python benchmarks/stream_encoding.py [--streams 1000,10000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import _encoding  # noqa: E402
+from _encoding import compress, dumps, encode, encode_list  # noqa: E402
+from _stream_store import StreamStore  # noqa: E402
+from stream_list import make_streams  # noqa: E402
+
+
+def response(data, total, timestamp='2024-01-21T14:22:00Z'):
+    return {'success': True, 'data': data, 'total': total, 'timestamp': timestamp}
+
+
+def encoders(store):
+    streams = store.all()
+
+    def fragments_cold():
+        store.fragments.clear()
+        return dumps(response(encode_list([store.fragment(stream, encode) for stream in streams]), len(streams)))
+
+    yield 'json indent=2', lambda: json.dumps(response(streams, len(streams)), indent=2).encode()
+    yield 'json compact', lambda: json.dumps(response(streams, len(streams)), separators=(',', ':'), ensure_ascii=False).encode()
+    if _encoding.orjson is not None:
+        yield 'orjson', lambda: _encoding.orjson.dumps(response(streams, len(streams)))
+    yield 'fragments, cold', fragments_cold
+    yield 'fragments, cached', lambda: dumps(response(encode_list([store.fragment(stream, encode) for stream in streams]), len(streams)))
+
+
+def measure(operation, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = operation()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', default='1000,10000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if _encoding.orjson else 'no'}, brotli: {'yes' if _encoding.brotli else 'no'}")
+    print(f"{'streams':>8} {'encoder':>18} {'ms':>10} {'bytes':>12}")
+    for count in (int(value) for value in args.streams.split(',')):
+        store = StreamStore(make_streams(count))
+        body = None
+        for name, operation in encoders(store):
+            elapsed, body = measure(operation, args.repeat)
+            print(f"{count:>8} {name:>18} {elapsed:>10.2f} {len(body):>12,}")
+        for coding in _encoding.ENCODINGS:
+            elapsed, (compressed, _) = measure(lambda: compress(body, coding), max(args.repeat // 4, 1))
+            print(f"{count:>8} {'+ ' + coding:>18} {elapsed:>10.2f} {len(compressed):>12,}")
+
+
+if __name__ == '__main__':
+    main()
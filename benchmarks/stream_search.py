@@ -0,0 +1,100 @@
+"""Filtered and searched stream lists in the serverless API at fleet scale.
+
+Builds N streams with varied names and locations, then times StreamStore.page()
+for the filters and ?q= searches the list endpoints accept, against a linear scan
+doing the same matching, and reports microseconds per query.
+
+    python benchmarks/stream_search.py [--streams 50000] [--repeat 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from _stream_store import StreamStore, index_key, tokenize  # noqa: E402
+
+CATEGORIES = ('security', 'traffic', 'nature', 'retail', 'default')
+PLACES = ('Entrance', 'Parking', 'Lobby', 'Warehouse', 'Loading Dock', 'Rooftop', 'Stairwell', 'Corridor')
+SITES = ('Building A', 'Building B', 'North Campus', 'South Campus', 'Depot', 'Harbour')
+CODECS = ('H.264', 'H.265', 'h264')
+RESOLUTIONS = ('1920x1080', '1280x720', '854x480', '3840x2160')
+
+QUERIES = (
+    ('category', {'category': 'retail'}),
+    ('active + codec', {'is_active': True, 'codec': 'h265'}),
+    ('resolution', {'resolution': '3840x2160'}),
+    ('q=lobby', {'q': 'lobby'}),
+    ('q=load', {'q': 'load'}),
+    ('q=harbour stair', {'q': 'harbour stair'}),
+    ('q=cam 4711', {'q': 'cam 4711'}),
+    ('q=north + active', {'q': 'north', 'is_active': True}),
+    ('q=nomatch', {'q': 'nomatch'}),
+)
+
+
+def make_streams(count):
+    rng = random.Random(1)
+    return [
+        {
+            'id': index + 1,
+            'url': f'rtsp://10.0.{index // 250}.{index % 250}/stream1',
+            'name': f'{rng.choice(PLACES)} Camera {index + 1}',
+            'category': CATEGORIES[index % len(CATEGORIES)],
+            'is_active': index % 4 != 0,
+            'is_favorite': index % 20 == 0,
+            'metadata': {
+                'location': f'{rng.choice(SITES)} - {rng.choice(PLACES)}',
+                'codec': rng.choice(CODECS),
+                'resolution': rng.choice(RESOLUTIONS),
+            },
+        }
+        for index in range(count)
+    ]
+
+
+def scan(streams, limit, q=None, **criteria):
+    """What the store answers, by testing every stream"""
+    words = tokenize(q)
+    results = []
+    for stream in streams:
+        metadata = stream['metadata']
+        if any(index_key(field, metadata.get(field) if field in ('codec', 'resolution') else stream.get(field))
+               != index_key(field, value) for field, value in criteria.items()):
+            continue
+        terms = tokenize(f"{stream['name']} {metadata['location']} {stream['category']}")
+        if all(any(term.startswith(word) for term in terms) for word in words):
+            results.append(stream)
+            if len(results) == limit:
+                break
+    return results
+
+
+def measure(operation, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = operation()
+    return (time.perf_counter() - started) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', default='50000')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'streams':>8} {'query':>18} {'matches':>8} {'indexed':>10} {'scan':>10}   (us/query, first page of 100)")
+    for count in (int(value) for value in args.streams.split(',')):
+        streams = make_streams(count)
+        store = StreamStore(streams)
+        for name, query in QUERIES:
+            indexed, (page, _) = measure(lambda: store.page(None, 100, **query), args.repeat)
+            scanned, expected = measure(lambda: scan(streams, 100, **query), max(args.repeat // 20, 3))
+            assert [stream['id'] for stream in page] == [stream['id'] for stream in expected], name
+            print(f"{count:>8} {name:>18} {store.count(**query):>8} {indexed:>10.1f} {scanned:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
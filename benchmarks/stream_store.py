@@ -0,0 +1,126 @@
+"""Stream lookups and mutations in the serverless API: list scans vs the indexed StreamStore.
+
+Runs the handler's operations (get by id, toggle favorite, update status, create,
+delete, active and favorites lists) against N streams and reports microseconds per op.
+
+    python benchmarks/stream_store.py [--streams 10000,100000] [--ops 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from _stream_store import StreamStore  # noqa: E402
+
+CATEGORIES = ('security', 'traffic', 'nature', 'retail', 'default')
+
+
+def make_streams(count):
+    return [
+        {
+            'id': index + 1,
+            'url': f'rtsp://10.0.{index // 250}.{index % 250}/stream1',
+            'name': f'Camera {index + 1}',
+            'category': CATEGORIES[index % len(CATEGORIES)],
+            'is_active': index % 4 != 0,
+            'is_favorite': index % 20 == 0,
+            'metadata': {},
+        }
+        for index in range(count)
+    ]
+
+
+class ListStore:
+    """The previous list-backed implementation, kept here as the baseline"""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def get(self, stream_id):
+        return next((s for s in self.streams if s['id'] == stream_id), None)
+
+    def update(self, stream_id, **fields):
+        stream = self.get(stream_id)
+        stream.update(fields)
+
+    def create(self, stream):
+        stream['id'] = max([s['id'] for s in self.streams], default=0) + 1
+        self.streams.append(stream)
+
+    def delete(self, stream_id):
+        self.streams.remove(self.get(stream_id))
+
+    def active(self):
+        return [s for s in self.streams if s['is_active']]
+
+    def favorites(self):
+        return [s for s in self.streams if s['is_favorite']]
+
+
+class IndexedStore:
+    def __init__(self, streams):
+        self.store = StreamStore(streams)
+
+    def get(self, stream_id):
+        return self.store.get(stream_id)
+
+    def update(self, stream_id, **fields):
+        self.store.update(stream_id, **fields)
+
+    def create(self, stream):
+        self.store.add(stream)
+
+    def delete(self, stream_id):
+        self.store.delete(stream_id)
+
+    def active(self):
+        return self.store.filter(is_active=True)
+
+    def favorites(self):
+        return self.store.filter(is_favorite=True)
+
+
+def measure(operation, ops):
+    started = time.perf_counter()
+    for index in range(ops):
+        operation(index)
+    return (time.perf_counter() - started) / ops * 1e6
+
+
+def run(store_class, count, ops):
+    store = store_class(make_streams(count))
+    ids = [random.randint(1, count) for _ in range(ops)]
+    # List scans are O(n) per call, so the whole-list operations get fewer repetitions
+    list_ops = max(ops // 100, 5)
+    return {
+        'get': measure(lambda i: store.get(ids[i]), ops),
+        'favorite': measure(lambda i: store.update(ids[i], is_favorite=i % 2 == 0), ops),
+        'status': measure(lambda i: store.update(ids[i], is_active=i % 3 != 0), ops),
+        'create': measure(lambda i: store.create({'id': None, 'category': 'default', 'is_active': True,
+                                                  'is_favorite': False}), ops),
+        'delete': measure(lambda i: store.delete(count + 1 + i), ops),
+        'active': measure(lambda i: store.active(), list_ops),
+        'favorites': measure(lambda i: store.favorites(), list_ops),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', default='10000,100000')
+    parser.add_argument('--ops', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    columns = ('get', 'favorite', 'status', 'create', 'delete', 'active', 'favorites')
+    print(f"{'streams':>8} {'store':>8} " + ' '.join(f"{name:>10}" for name in columns) + "   (us/op)")
+    for count in (int(value) for value in args.streams.split(',')):
+        for name, store_class in (('list', ListStore), ('indexed', IndexedStore)):
+            results = run(store_class, count, args.ops)
+            print(f"{count:>8} {name:>8} " + ' '.join(f"{results[column]:>10.2f}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Fail when a module the serverless API copies from the backend has drifted from it.
+
+Vercel runs api/ with PYTHONPATH=api, so it cannot import backend/streams and
+keeps its own copies. Each pair must match, apart from the listed import lines
+that name the other app's module.
+
+    python scripts/check_shared_modules.py
+"""
+import difflib
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# (backend module, serverless copy, {backend line: serverless line})
+SHARED_MODULES = (
+    ('backend/streams/rtsp.py', 'api/_rtsp_probe.py', {}),
+    ('backend/streams/listing.py', 'api/_listing.py', {
+        'from .rtsp import codec_spellings\n': 'from ._rtsp_probe import codec_spellings\n',
+    }),
+    ('backend/streams/serializers.py', 'api/serializers.py', {}),
+)
+
+
+def read_lines(path):
+    with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+        return f.readlines()
+
+
+def main():
+    drifted = 0
+    for original, copy, renames in SHARED_MODULES:
+        expected = [renames.get(line, line) for line in read_lines(original)]
+        actual = read_lines(copy)
+        if actual != expected:
+            drifted += 1
+            sys.stdout.writelines(difflib.unified_diff(expected, actual, original, copy))
+    if drifted:
+        print(f"{drifted} shared module(s) differ; make the same change in both")
+        return 1
+    print(f"{len(SHARED_MODULES)} shared modules match")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())